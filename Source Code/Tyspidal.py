@@ -1,16 +1,10 @@
-from auth import open_tidal_session, open_spotify_session
-from functools import partial
-from multiprocessing import Pool, freeze_support
-import requests
+from sync_engine import sync, sync_library, get_spotify_user_playlists
+from auth import get_tidal_session, open_spotify_session
 import ctypes, sys
-import spotipy
-import tidalapi
-from tidalapi_patch import set_tidal_playlist
-import time
-import traceback
-import unicodedata
 import yaml
+import queue
 import threading
+import traceback
 import os
 import webbrowser
 import requests
@@ -19,28 +13,22 @@ import urllib.request
 from startup import startup
 import subprocess
 import customtkinter
-from PIL import Image
-from io import BytesIO
-from urllib.request import urlopen
+from artwork import ArtworkCache
+from config_store import get_config_store
+from sync_schedule import mark_synced
+from log_buffer import LogBuffer
 
 def add_schedule(id_data):
-    try:
-        with open('config.yml', 'r') as yaml_file:
-            config = yaml.safe_load(yaml_file)
-    except FileNotFoundError:
-        config = {'schedule': {}}
-    if 'schedule' not in config:
-        config['schedule'] = {}
-
-    for id_data in id_data:
-        id_value = id_data['id']
-        config['schedule'][id_value] = {
-            'type': id_data['type'],
-            'last_up': id_data['last_up']
-        }
+    # the time goes to the sync state first, so the scheduler doesn't see the playlist before it
+    for item in id_data:
+        mark_synced([item['id']], item['last_up'])
 
-    with open('config.yml', 'w') as yaml_file:
-        yaml.dump(config, yaml_file, default_flow_style=False)
+    def add(config):
+        if not config.get('schedule'):
+            config['schedule'] = {}
+        for item in id_data:
+            config['schedule'][item['id']] = {'type': item['type']}
+    get_config_store().update(add)
 
 def is_admin():
     try:
@@ -49,284 +37,8 @@ def is_admin():
         return False
 
 
-def normalize(s):
-    return unicodedata.normalize('NFD', s).encode('ascii', 'ignore').decode('ascii')
-
-def simple(input_string):
-    # only take the first part of a string before any hyphens or brackets to account for different versions
-    return input_string.split('-')[0].strip().split('(')[0].strip().split('[')[0].strip()
-
-def isrc_match(tidal_track, spotify_track):
-    if "isrc" in spotify_track["external_ids"]:
-        return tidal_track.isrc == spotify_track["external_ids"]["isrc"]
-    return False
-
-def duration_match(tidal_track, spotify_track, tolerance=2):
-    # the duration of the two tracks must be the same to within 2 seconds
-    return abs(tidal_track.duration - spotify_track['duration_ms']/1000) < tolerance
-
-def name_match(tidal_track, spotify_track):
-    def exclusion_rule(pattern, tidal_track, spotify_track):
-        spotify_has_pattern = pattern in spotify_track['name'].lower()
-        tidal_has_pattern = pattern in tidal_track.name.lower() or (not tidal_track.version is None and (pattern in tidal_track.version.lower()))
-        return spotify_has_pattern != tidal_has_pattern
-
-    # handle some edge cases
-    if exclusion_rule("instrumental", tidal_track, spotify_track): return False
-    if exclusion_rule("acapella", tidal_track, spotify_track): return False
-    if exclusion_rule("remix", tidal_track, spotify_track): return False
-
-    # the simplified version of the Spotify track name must be a substring of the Tidal track name
-    # Try with both un-normalized and then normalized
-    simple_spotify_track = simple(spotify_track['name'].lower()).split('feat.')[0].strip()
-    return simple_spotify_track in tidal_track.name.lower() or normalize(simple_spotify_track) in normalize(tidal_track.name.lower())
-
-def artist_match(tidal_track, spotify_track):
-    def split_artist_name(artist):
-       if '&' in artist:
-           return artist.split('&')
-       elif ',' in artist:
-           return artist.split(',')
-       else:
-           return [artist]
-
-    def get_tidal_artists(tidal_track, do_normalize=False):
-        result = []
-        for artist in tidal_track.artists:
-            if do_normalize:
-                artist_name = normalize(artist.name)
-            else:
-                artist_name = artist.name
-            result.extend(split_artist_name(artist_name))
-        return set([simple(x.strip().lower()) for x in result])
-
-    def get_spotify_artists(spotify_track, do_normalize=False):
-        result = []
-        for artist in spotify_track['artists']:
-            if do_normalize:
-                artist_name = normalize(artist['name'])
-            else:
-                artist_name = artist['name']
-            result.extend(split_artist_name(artist_name))
-        return set([simple(x.strip().lower()) for x in result])
-    # There must be at least one overlapping artist between the Tidal and Spotify track
-    # Try with both un-normalized and then normalized
-    if get_tidal_artists(tidal_track).intersection(get_spotify_artists(spotify_track)) != set():
-        return True
-    return get_tidal_artists(tidal_track, True).intersection(get_spotify_artists(spotify_track, True)) != set()
-
-def match(tidal_track, spotify_track):
-    return isrc_match(tidal_track, spotify_track) or (
-        duration_match(tidal_track, spotify_track)
-        and name_match(tidal_track, spotify_track)
-        and artist_match(tidal_track, spotify_track)
-    )
-
-
-def tidal_search(spotify_track_and_cache, tidal_session):
-    spotify_track, cached_tidal_track = spotify_track_and_cache
-    if cached_tidal_track: return cached_tidal_track
-    # search for album name and first album artist
-    if 'album' in spotify_track and 'artists' in spotify_track['album'] and len(spotify_track['album']['artists']):
-        album_result = tidal_session.search(simple(spotify_track['album']['name']) + " " + simple(spotify_track['album']['artists'][0]['name']), models=[tidalapi.album.Album])
-        for album in album_result['albums']:
-            album_tracks = album.tracks()
-            if len(album_tracks) >= spotify_track['track_number']:
-                track = album_tracks[spotify_track['track_number'] - 1]
-                if match(track, spotify_track):
-                    return track
-    # if that fails then search for track name and first artist
-    for track in tidal_session.search(simple(spotify_track['name']) + ' ' + simple(spotify_track['artists'][0]['name']), models=[tidalapi.media.Track])['tracks']:
-        if match(track, spotify_track):
-            return track
-
-def get_tidal_playlists_dict(tidal_session):
-    # a dictionary of name --> playlist
-    tidal_playlists = tidal_session.user.playlists()
-    output = {}
-    for playlist in tidal_playlists:
-        output[playlist.name] = playlist
-    return output 
-
-def repeat_on_request_error(function, *args, remaining=5, **kwargs):
-    # utility to repeat calling the function up to 5 times if an exception is thrown
-    try:
-        return function(*args, **kwargs)
-    except requests.exceptions.RequestException as e:
-        if remaining:
-            print(f"{str(e)} occurred, retrying {remaining} times")
-        else:
-            print(f"{str(e)} could not be recovered")
-
-        if not e.response is None:
-            print(f"Response message: {e.response.text}")
-            print(f"Response headers: {e.response.headers}")
-
-        if not remaining:
-            print("Aborting sync")
-            print(f"The following arguments were provided:\n\n {str(args)}")
-            print(traceback.format_exc())
-            sys.exit(1)
-        sleep_schedule = {5: 1, 4:10, 3:60, 2:5*60, 1:10*60} # sleep variable length of time depending on retry number
-        time.sleep(sleep_schedule.get(remaining, 1))
-        return repeat_on_request_error(function, *args, remaining=remaining-1, **kwargs)
-
-def _enumerate_wrapper(value_tuple, function, **kwargs):
-    # just a wrapper which accepts a tuple from enumerate and returns the index back as the first argument
-    index, value = value_tuple
-    return (index, repeat_on_request_error(function, value, **kwargs))
-
-def call_async_with_progress(function, values, description, num_processes, **kwargs):
-    results = len(values)*[None]
-    with Pool(processes=num_processes) as process_pool:
-        for index, result in process_pool.imap_unordered(partial(_enumerate_wrapper, function=function, **kwargs),
-                                  enumerate(values)):
-            results[index] = result
-    return results
-
-def get_tracks_from_spotify_playlist(spotify_session, spotify_playlist):
-    output = []
-    results = spotify_session.playlist_tracks(
-        spotify_playlist["id"],
-        fields="next,items(track(name,album(name,artists),artists,track_number,duration_ms,id,external_ids(isrc)))",
-    )
-    while True:
-        output.extend([r['track'] for r in results['items'] if r['track'] is not None])
-        # move to the next page of results if there are still tracks remaining in the playlist
-        if results['next']:
-            results = spotify_session.next(results)
-        else:
-            return output
-
-class TidalPlaylistCache:
-    def __init__(self, playlist):
-        self._data = playlist.tracks()
-
-    def _search(self, spotify_track):
-        ''' check if the given spotify track was already in the tidal playlist.'''
-        results = []
-        for tidal_track in self._data:
-            if match(tidal_track, spotify_track):
-                return tidal_track
-        return None
-
-    def search(self, spotify_session, spotify_playlist):
-        ''' Add the cached tidal track where applicable to a list of spotify tracks '''
-        results = []
-        cache_hits = 0
-        work_to_do = False
-        spotify_tracks = get_tracks_from_spotify_playlist(spotify_session, spotify_playlist)
-        for track in spotify_tracks:
-            cached_track = self._search(track)
-            if cached_track:
-                results.append( (track, cached_track) )
-                cache_hits += 1
-            else:
-                results.append( (track, None) )
-        return (results, cache_hits)
-
-def tidal_playlist_is_dirty(playlist, new_track_ids):
-    old_tracks = playlist.tracks()
-    if len(old_tracks) != len(new_track_ids):
-        return True
-    for i in range(len(old_tracks)):
-        if old_tracks[i].id != new_track_ids[i]:
-            return True
-    return False
-
-def sync_playlist(spotify_session, tidal_session, spotify_id, tidal_id, config):
-    try:
-        spotify_playlist = spotify_session.playlist(spotify_id)
-    except spotipy.SpotifyException as e:
-        print("Error getting Spotify playlist " + spotify_id + "make sure the playlist is yours and the ID is correct")
-        #print(e)
-        #results.append(None)
-        return
-    
-    if tidal_id:
-        # if a Tidal playlist was specified then look it up
-        try:
-            tidal_playlist = tidal_session.playlist(tidal_id)
-        except Exception as e:
-            print("Error getting Tidal playlist " + tidal_id)
-            print(e)
-            return
-    else:
-        # create a new Tidal playlist if required
-        print(f"No playlist found on Tidal corresponding to Spotify playlist: '{spotify_playlist['name']}', creating new playlist")
-        tidal_playlist =  tidal_session.user.create_playlist(spotify_playlist['name'], spotify_playlist['description'])
-    tidal_track_ids = []
-    spotify_tracks, cache_hits = TidalPlaylistCache(tidal_playlist).search(spotify_session, spotify_playlist)
-    if cache_hits == len(spotify_tracks):
-        print("No new tracks to search in Spotify playlist '{}'".format(spotify_playlist['name']))
-        return
-    print ("Searching Tidal for {}/{} tracks in Spotify playlist '{}'".format(len(spotify_tracks) - cache_hits, len(spotify_tracks), spotify_playlist['name']))
-    task_description = "Searching Tidal for {}/{} tracks in Spotify playlist '{}'".format(len(spotify_tracks) - cache_hits, len(spotify_tracks), spotify_playlist['name'])
-    tidal_tracks = call_async_with_progress(tidal_search, spotify_tracks, task_description, config.get('subprocesses', 50), tidal_session=tidal_session)
-    print ('Search done')
-    for index, tidal_track in enumerate(tidal_tracks):
-        spotify_track = spotify_tracks[index][0]
-        if tidal_track:
-            tidal_track_ids.append(tidal_track.id)
-        else:
-            print("Could not find track : {} - {}".format([a['name'] for a in spotify_track['artists']], spotify_track['name']))
-    if tidal_playlist_is_dirty(tidal_playlist, tidal_track_ids):
-        set_tidal_playlist(tidal_playlist, tidal_track_ids)
-    else:
-        print("No changes to write to Tidal playlist")
-
-def sync_list(spotify_session, tidal_session, playlists, config):
-  results = []
-  for spotify_id, tidal_id in playlists:
-    # sync the spotify playlist to tidal
-    repeat_on_request_error(sync_playlist, spotify_session, tidal_session, spotify_id, tidal_id, config)
-    results.append(tidal_id)
-  return results
-
-def pick_tidal_playlist_for_spotify_playlist(spotify_playlist, tidal_playlists):
-    if spotify_playlist['name'] in tidal_playlists:
-      # if there's an existing tidal playlist with the name of the current playlist then use that
-      tidal_playlist = tidal_playlists[spotify_playlist['name']]
-      return (spotify_playlist['id'], tidal_playlist.id)
-    else:
-      return (spotify_playlist['id'], None)
-    
-
-
-def sync(url):
-    if url=='':
-        print ("Missing ID!")
-    else:
-        with open('config.yml', 'r') as f:
-            config = yaml.safe_load(f)
-        spotify_session = open_spotify_session(config['spotify'])
-        tidal_session = open_tidal_session()
-        if not tidal_session.check_login():
-            sys.exit("Could not connect to Tidal")
-        try:
-            spotify_playlist = spotify_session.playlist(url)
-        except spotipy.SpotifyException as e:
-            print("Error getting Spotify playlist \"" + url + "\"\nMake sure the playlist ID is correct.")
-            print(e)
-            return
-        tidal_playlists = get_tidal_playlists_dict(tidal_session)
-        tidal_playlist = pick_tidal_playlist_for_spotify_playlist(spotify_playlist, tidal_playlists)
-        sync_list(spotify_session, tidal_session, [tidal_playlist], config)
-        
-
-
-
-
-class StdoutRedirector:
-    def __init__(self, callback):
-        self.callback = callback
-
-    def write(self, text):
-        self.callback(text)
-    def flush(self):
-        pass 
-
-
+# lines kept in the console textbox
+CONSOLE_SCROLLBACK = 1000
 
 
 class App(customtkinter.CTk):
@@ -336,24 +48,31 @@ class App(customtkinter.CTk):
         self.title("Tyspidal")
         self.geometry("700x450")
 
+        # results of background tasks, handed to the Tk thread by a timer
+        self._ui_calls = queue.Queue()
+        self.after(50, self._run_ui_calls)
+
         # set grid layout 1x2
         self.grid_rowconfigure(0, weight=1)
         self.grid_columnconfigure(1, weight=1)
 
-        def sync_and_update_output(url):
-            def update_output(text):
-                output_text.insert("end", text)
-                output_text.see("end")
+        # the sync thread prints into the buffer, the console drains it in batches on a timer
+        log_buffer = LogBuffer()
 
-            sys.stdout = StdoutRedirector(update_output)
+        def sync_and_update_output(function, *args):
+            sys.stdout = log_buffer
             print ("Initializing...")
-            sync(url)
+            function(*args)
             print ("Done!")
             sys.stdout = sys.__stdout__  # Restore the original sys.stdout
 
         def button_sync():
             url = entry_1.get()
-            t = threading.Thread(target=sync_and_update_output, args=(url,))
+            t = threading.Thread(target=sync_and_update_output, args=(sync, url))
+            t.start()
+
+        def button_sync_all():
+            t = threading.Thread(target=sync_and_update_output, args=(sync_library,))
             t.start()
 
         # create navigation frame
@@ -388,18 +107,14 @@ class App(customtkinter.CTk):
             webbrowser.open_new(url)
         self.home_frame = customtkinter.CTkFrame(self, corner_radius=0, fg_color="transparent")
         self.home_frame.grid_columnconfigure(0, weight=1)
-        with open('config.yml', 'r') as f:
-            config = yaml.safe_load(f)
+        config = get_config_store().load()
 
             #############################needs directory for pyinstaller/setup################################################
         def button_update():
-            fname = "config.yml"
-            config['spotify']['client_id']=entry_2.get()
-            config['spotify']['client_secret']=entry_3.get()
-            config['spotify']['username']=entry_4.get()
-            config['spotify']['redirect_uri']=entry_5.get()
-            with open(fname, 'w') as yml_file:
-                yml_file.write(yaml.dump(config, default_flow_style=False))
+            spotify = {'client_id': entry_2.get(), 'client_secret': entry_3.get(), 'username': entry_4.get(), 'redirect_uri': entry_5.get()}
+            config['spotify'].update(spotify)
+            # only the fields edited here are written, the schedule may have changed since the config was loaded
+            get_config_store().update(lambda stored: stored['spotify'].update(spotify))
             
         label_1 = customtkinter.CTkLabel(master=self.home_frame, justify=customtkinter.LEFT, text="Welcome!")
         label_1.pack(pady=0, padx=0)
@@ -437,9 +152,9 @@ class App(customtkinter.CTk):
         label.bind("<Button-1>", lambda e: callback("https://developer.spotify.com/dashboard"))
         
 
-        def connect(host='http://google.com'):
+        def connect(host='http://google.com', timeout=5):
             try:
-                urllib.request.urlopen(host) #Python 3.x
+                urllib.request.urlopen(host, timeout=timeout) #Python 3.x
                 return True
             except:
                 return False
@@ -452,15 +167,40 @@ class App(customtkinter.CTk):
         self.tabview.pack()
         self.tabview.add("Normal")
         self.tabview.add("Scheduled")
-        if config['spotify']['client_id'] and config['spotify']['client_secret'] and config['spotify']['username'] and config['spotify']['redirect_uri'] and connect():
-            tidal_session = open_tidal_session()
+        has_credentials = config['spotify']['client_id'] and config['spotify']['client_secret'] and config['spotify']['username'] and config['spotify']['redirect_uri']
+
+        def load_playlists():
+            ''' Runs in the background: log in and list the library '''
+            # logs in to Tidal now, the syncs started from the window reuse the session
+            get_tidal_session()
             spotify_session = open_spotify_session(config['spotify'])
             os.startfile(os.getcwd()+"\\Taskspydal.exe")
-            data = spotify_session.current_user_playlists()
+            return list(get_spotify_user_playlists(spotify_session))
+
+        # filled in by show_playlists once the library is loaded
+        entry_1 = output_text = None
+
+        def update_output():
+            text = log_buffer.drain()
+            if text and output_text is not None:
+                output_text.insert("end", text)
+                # trim the scrollback so the textbox stays cheap however long the sync runs
+                output_text.delete("1.0", "end-{}l".format(CONSOLE_SCROLLBACK + 1))
+                output_text.see("end")
+            self.after(100, update_output)
+        self.after(100, update_output)
+
+        def show_playlists(playlists):
+            nonlocal entry_1, output_text
+            loading_label.destroy()
+            if isinstance(playlists, BaseException) or not playlists:
+                label_1 = customtkinter.CTkLabel(self.tabview.tab("Normal"), justify=customtkinter.CENTER, text="Could not load your playlists, check the settings and relaunch Tyspidal", text_color="red")
+                label_1.pack(pady=20, padx=0)
+                return
             playlist_info = {}
             
-            # Populate the playlist_info dictionary
-            for item in data['items']:
+            # Populate the playlist_info dictionary with every page of the library
+            for item in playlists:
                 playlist_id = item['id']
                 playlist_name = item['name']
                 
@@ -475,28 +215,31 @@ class App(customtkinter.CTk):
                 'url': playlist_url
                 }
             mlist=list(playlist_info.keys())
+            first_url = list(playlist_info.values())[0]['url']
+            # thumbnails load in the background and are cached, the window never waits for them
+            artwork = ArtworkCache(self)
+            artwork.prefetch(info['url'] for info in playlist_info.values())
+            selected_url = {'url': first_url}
+            def show_image(button, url, image):
+                if url != selected_url['url']:
+                    return # the user picked another playlist in the meantime
+                if image is None:
+                    button.configure(image=artwork.placeholder(), text="error displaying image \nbut it's fine my g carry on")
+                else:
+                    button.configure(image=image, text="")
+
             def optionmenu_callback(choice):
                 #print("optionmenu dropdown clicked:", choice)
                 entry_1.delete(0,customtkinter.END)
                 entry_1.insert(0,playlist_info[choice]['id'])
-                try:
-                    image=display_image(playlist_info[choice]['url'])
-                    myimage.configure(light_image=image,dark_image=image)
-                    button.configure(text="")
-                except:
-                    button.configure(text="error displaying image \nbut it's fine my g carry on")
-
-            def display_image(image_url):
-                response = urlopen(image_url)
-                image_data = response.read()
-                image = Image.open(BytesIO(image_data))
-                return image
+                url = selected_url['url'] = playlist_info[choice]['url']
+                artwork.get(url, lambda image, button=button: show_image(button, url, image))
             #Normal
             optionmenu = customtkinter.CTkOptionMenu(self.tabview.tab("Normal"), values=mlist,command=optionmenu_callback)
             optionmenu.pack(pady=10, padx=10)
-            myimage=customtkinter.CTkImage(light_image=display_image(list(playlist_info.values())[0]['url']),dark_image=display_image(list(playlist_info.values())[0]['url']),size=(100, 100))
-            button = customtkinter.CTkButton(self.tabview.tab("Normal"), image=myimage,text='',fg_color="transparent",state="disabled")
+            button = customtkinter.CTkButton(self.tabview.tab("Normal"), image=artwork.placeholder(),text='',fg_color="transparent",state="disabled")
             button.pack()
+            artwork.get(first_url, lambda image, button=button: show_image(button, first_url, image))
             label_1 = customtkinter.CTkLabel(self.tabview.tab("Normal"), justify=customtkinter.LEFT, text="Spotify playlist ID")
             label_1.pack(pady=0, padx=0)
             entry_1 = customtkinter.CTkEntry(self.tabview.tab("Normal"), placeholder_text="ID")
@@ -504,6 +247,8 @@ class App(customtkinter.CTk):
             entry_1.insert(0,list(playlist_info.values())[0]['id'])
             button_2 = customtkinter.CTkButton(self.tabview.tab("Normal"), command=button_sync,text="Sync")
             button_2.pack(pady=5, padx=5)
+            button_3 = customtkinter.CTkButton(self.tabview.tab("Normal"), command=button_sync_all,text="Sync all playlists")
+            button_3.pack(pady=5, padx=5)
             console_frame = customtkinter.CTkFrame(self.tabview.tab("Normal"))
             console_frame.pack(side=customtkinter.LEFT,fill="both", expand=True)
             output_text  = customtkinter.CTkTextbox(master=console_frame)
@@ -514,7 +259,7 @@ class App(customtkinter.CTk):
                 now = datetime.now()
                 import datetime
                 id_data = [
-                {'id': entry_1.get(), 'type': optionmenu_1.get(), 'last_up': now.strftime("%d/%m/%Y %H:%M:%S")}
+                {'id': entry_1.get(), 'type': optionmenu_1.get(), 'last_up': now}
                 ]
                 add_schedule(id_data)
                 task_name = "Sync playlist id "+entry_1.get()
@@ -529,9 +274,9 @@ class App(customtkinter.CTk):
                 subprocess.run(command, shell=True)
             optionmenu = customtkinter.CTkOptionMenu(self.tabview.tab("Scheduled"), values=mlist,command=optionmenu_callback)
             optionmenu.pack(pady=10, padx=10)
-            myimage=customtkinter.CTkImage(light_image=display_image(list(playlist_info.values())[0]['url']),dark_image=display_image(list(playlist_info.values())[0]['url']),size=(100, 100))
-            button = customtkinter.CTkButton(self.tabview.tab("Scheduled"), image=myimage,text='',fg_color="transparent",state="disabled")
+            button = customtkinter.CTkButton(self.tabview.tab("Scheduled"), image=artwork.placeholder(),text='',fg_color="transparent",state="disabled")
             button.pack()
+            artwork.get(first_url, lambda image, button=button: show_image(button, first_url, image))
             label_1 = customtkinter.CTkLabel(self.tabview.tab("Scheduled"), justify=customtkinter.LEFT, text="Spotify playlist ID")
             label_1.pack(pady=0, padx=0)
             entry_1 = customtkinter.CTkEntry(self.tabview.tab("Scheduled"), placeholder_text="ID")
@@ -544,6 +289,9 @@ class App(customtkinter.CTk):
             button_2 = customtkinter.CTkButton(self.tabview.tab("Scheduled"), command=button_schedule,text="Schedule Sync")
             button_2.pack(pady=20, padx=10)
 
+        # logging in and listing the library take seconds, the window shows up first and the tabs fill in once they're done
+        loading_label = customtkinter.CTkLabel(self.tabview.tab("Normal"), justify=customtkinter.CENTER, text="Loading your playlists...")
+        loading_label.pack(pady=20, padx=0)
         
 
         # create third frame
@@ -557,29 +305,49 @@ class App(customtkinter.CTk):
         label.pack(pady=0, padx=0)
         label.bind("<Button-1>", lambda e: callback("https://github.com/timrae/spotify_to_tidal"))
         
-        if connect() :
+        self.status = customtkinter.CTkLabel(self.navigation_frame,justify=customtkinter.CENTER, corner_radius=0, height=40, text="      CONNECTING",
+                                               fg_color="gray", text_color=("gray10", "gray90"), anchor="w")
+        self.status.grid(row=6, column=0, sticky="ew")
+
+        def load_credits():
+            ''' Runs in the background: the credits text '''
             url = "https://ivory-britney-30.tiiny.site/"
-            response = requests.get(url)
+            try:
+                response = requests.get(url, timeout=10)
+            except requests.exceptions.RequestException:
+                return ''
             if response.status_code == 200:
                 soup = BeautifulSoup(response.content, 'html.parser')
-                text = soup.get_text()
+                return soup.get_text()
+            return ''
+
+        def show_credits(text):
+            # the credits are a nice to have, the app works the same without them
+            if text and not isinstance(text, BaseException):
                 label_1 = customtkinter.CTkLabel(master=self.third_frame, justify=customtkinter.CENTER, text=text)
                 label_1.pack(pady=0, padx=0)
-                self.status = customtkinter.CTkLabel(self.navigation_frame,justify=customtkinter.CENTER, corner_radius=0, height=40, text="      ONLINE",
-                                                   fg_color="green", text_color=("gray10", "gray90"), anchor="w")
-                self.status.grid(row=6, column=0, sticky="ew")
-        else: 
-            self.status = customtkinter.CTkLabel(self.navigation_frame,justify=customtkinter.CENTER, corner_radius=0, height=40, text="OFFLINE \n Go ONLINE and relaunch Tyspidal ",
-                                                   fg_color="red", text_color=("gray10", "gray90"), anchor="w")
-            self.status.grid(row=6, column=0, sticky="ew")
+
+        def show_online(online):
+            if online is not True:
+                self.status.configure(text="OFFLINE \n Go ONLINE and relaunch Tyspidal ", fg_color="red")
+                loading_label.configure(text="Go ONLINE and relaunch Tyspidal to load your playlists")
+                return
+            self.status.configure(text="      ONLINE", fg_color="green")
+            # the logins and the credits page don't wait for each other
+            if has_credentials:
+                self.run_in_background(load_playlists, show_playlists)
+            else:
+                loading_label.configure(text="Fill in your Spotify information in the Profile tab and relaunch Tyspidal")
+            self.run_in_background(load_credits, show_credits)
+
+        self.run_in_background(connect, show_online)
 
         # create settings frame
         self.settings_frame = customtkinter.CTkFrame(self, corner_radius=0, fg_color="transparent")
         def switch_event():
             startup(switch.get())
             config['settings']['startup']=switch.get()
-            with open("config.yml", 'w') as yml_file:
-                yml_file.write(yaml.dump(config, default_flow_style=False))
+            get_config_store().update(lambda stored: stored['settings'].update(startup=switch.get()))
         switch = customtkinter.CTkSwitch(master=self.settings_frame, text="Run on windows startup (to keep your playlists synced)",command=switch_event)
         if config['settings']['startup']:
             switch.toggle()
@@ -590,6 +358,27 @@ class App(customtkinter.CTk):
         # select default frame
         self.select_frame_by_name("home")
 
+    def run_in_background(self, work, done):
+        ''' Run work() on a thread and done(result) on the Tk thread once it returns, with the exception if it raised '''
+        def run():
+            try:
+                result = work()
+            # the logins sys.exit() on errors, which would otherwise end the thread without ever calling done
+            except (Exception, SystemExit) as e:
+                print(traceback.format_exc())
+                result = e
+            self._ui_calls.put(lambda: done(result))
+        threading.Thread(target=run, daemon=True).start()
+
+    def _run_ui_calls(self):
+        while True:
+            try:
+                call = self._ui_calls.get_nowait()
+            except queue.Empty:
+                break
+            call()
+        self.after(50, self._run_ui_calls)
+
     def select_frame_by_name(self, name):
         # set button color for selected button
         self.home_button.configure(fg_color=("gray75", "gray25") if name == "home" else "transparent")
@@ -632,7 +421,6 @@ class App(customtkinter.CTk):
 
 
 if __name__ == "__main__":
-    freeze_support() 
     if is_admin():
         config_data = {
         'spotify': {
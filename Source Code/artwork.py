@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from atomic_write import write_atomically
+import hashlib
+import os
+import queue
+import requests
+import customtkinter
+from PIL import Image
+
+class ArtworkCache:
+    ''' Playlist thumbnails for the GUI. Images are downloaded on a thread pool, kept on disk by URL with least recently
+        used eviction, and decoded and downscaled once into CTkImages that stay in memory. Callbacks run on the Tk thread. '''
+    def __init__(self, root, directory='.artwork_cache', size=(100, 100), max_disk_bytes=50*1024*1024, max_images=512, workers=4):
+        self.root = root
+        self.directory = directory
+        self.size = size
+        self.max_disk_bytes = max_disk_bytes
+        self.max_images = max_images
+        self._images = OrderedDict()
+        self._pending = {}
+        self._done = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='artwork')
+        os.makedirs(directory, exist_ok=True)
+        self._placeholder = None
+        self.root.after(50, self._deliver)
+
+    def _path(self, url):
+        return os.path.join(self.directory, hashlib.sha1(url.encode()).hexdigest())
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            # leave the temporary files of downloads still being written alone
+            if entry.is_file() and not entry.name.startswith('.'):
+                entries.append((entry.stat().st_mtime, entry.stat().st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def _load(self, url):
+        ''' Runs on the pool: the decoded, downscaled image from the disk cache, or downloaded into it '''
+        path = self._path(url)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            # the modification time is what eviction orders by
+            os.utime(path)
+        except OSError:
+            response = requests.get(url, timeout=10)
+            response.raise_for_status()
+            data = response.content
+            write_atomically(path, data)
+            self._evict()
+        # twice the display size keeps thumbnails sharp on scaled displays
+        size = (self.size[0]*2, self.size[1]*2)
+        image = Image.open(BytesIO(data))
+        # let the JPEG decoder skip straight to a reduced scale
+        image.draft('RGB', size)
+        image = image.convert('RGB')
+        image.thumbnail(size)
+        return image
+
+    def _finished(self, url, future):
+        self._done.put((url, future))
+
+    def _deliver(self):
+        ''' Tk timer: turn finished downloads into CTkImages and hand them to whoever asked '''
+        while True:
+            try:
+                url, future = self._done.get_nowait()
+            except queue.Empty:
+                break
+            callbacks = self._pending.pop(url, [])
+            try:
+                decoded = future.result()
+                image = customtkinter.CTkImage(light_image=decoded, dark_image=decoded, size=self.size)
+            except Exception as e:
+                print("Could not load playlist image: " + str(e))
+                image = None
+            else:
+                self._remember(url, image)
+            for callback in callbacks:
+                callback(image)
+        self.root.after(50, self._deliver)
+
+    def _remember(self, url, image):
+        self._images[url] = image
+        self._images.move_to_end(url)
+        while len(self._images) > self.max_images:
+            self._images.popitem(last=False)
+
+    def placeholder(self):
+        ''' A blank thumbnail to show until the real one arrives '''
+        if self._placeholder is None:
+            blank = Image.new('RGB', self.size, (40, 40, 40))
+            self._placeholder = customtkinter.CTkImage(light_image=blank, dark_image=blank, size=self.size)
+        return self._placeholder
+
+    def get(self, url, callback):
+        ''' Call callback(CTkImage) on the Tk thread, right away if the image is in memory, None if it can't be loaded '''
+        if not url:
+            callback(None)
+        elif url in self._images:
+            self._images.move_to_end(url)
+            callback(self._images[url])
+        elif url in self._pending:
+            self._pending[url].append(callback)
+        else:
+            self._pending[url] = [callback]
+            self._executor.submit(self._load, url).add_done_callback(lambda future: self._finished(url, future))
+
+    def prefetch(self, urls):
+        ''' Start loading thumbnails that are likely to be shown soon '''
+        for url in urls:
+            if url:
+                self.get(url, lambda image: None)
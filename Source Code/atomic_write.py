@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+import os
+import tempfile
+
+# file locks are msvcrt on Windows and fcntl everywhere else
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+    import fcntl
+
+def write_atomically(path, data):
+    ''' Replace the file at path with data, text or bytes, so that readers see either the old or the new file, never half of one '''
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb' if isinstance(data, bytes) else 'w') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+@contextmanager
+def locked(path):
+    ''' Hold an exclusive lock on path, shared with other processes, through a lock file next to it '''
+    with open(path + '.lock', 'a+') as lock_file:
+        if msvcrt:
+            # locking() only gives up after trying for about ten seconds
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
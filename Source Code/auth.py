@@ -1,11 +1,17 @@
 #!/usr/bin/env python3
 
+from atomic_write import write_atomically
+import datetime
+import functools
 import sys
 import spotipy
+import threading
 import tidalapi
 import webbrowser
 import yaml
 
+SESSION_FILE = '.session.yml'
+
 def open_spotify_session(config):
 
     credentials_manager = spotipy.SpotifyOAuth(username=config['username'],
@@ -20,9 +26,17 @@ def open_spotify_session(config):
 
     return spotipy.Spotify(oauth_manager=credentials_manager)
 
-def open_tidal_session(config = None):
+def save_tidal_session(session):
+    write_atomically(SESSION_FILE, yaml.dump({'session_id': session.session_id,
+                                              'token_type': session.token_type,
+                                              'access_token': session.access_token,
+                                              'refresh_token': session.refresh_token,
+                                              'expiry_time': session.expiry_time}))
+
+def open_tidal_session(config = None, prepare=None):
+    ''' prepare(session) is called on the new session before it logs in '''
     try:
-        with open('.session.yml', 'r') as session_file:
+        with open(SESSION_FILE, 'r') as session_file:
             previous_session = yaml.safe_load(session_file)
     except OSError:
         previous_session = None
@@ -31,11 +45,14 @@ def open_tidal_session(config = None):
         session = tidalapi.Session(config=config)
     else:
         session = tidalapi.Session()
+    if prepare:
+        prepare(session)
     if previous_session:
         try:
             if session.load_oauth_session(token_type= previous_session['token_type'],
                                    access_token=previous_session['access_token'],
-                                   refresh_token=previous_session['refresh_token'] ):
+                                   refresh_token=previous_session['refresh_token'],
+                                   expiry_time=previous_session.get('expiry_time') ):
                 return session
         except Exception as e:
             print("Error loading previous Tidal Session: \n" + str(e) )
@@ -48,11 +65,84 @@ def open_tidal_session(config = None):
         url = 'https://' + url
     webbrowser.open(url)
     future.result()
-    with open('.session.yml', 'w') as f:
-        yaml.dump( {'session_id': session.session_id,
-                   'token_type': session.token_type,
-                   'access_token': session.access_token,
-                   'refresh_token': session.refresh_token}, f )
+    save_tidal_session(session)
     return session
 
+class TidalSessionManager:
+    ''' The one logged in Tidal session of the process, shared by every sync it runs so they all reuse its
+        connections. The access token is refreshed by a timer shortly before it expires, and a refresh that
+        is needed anyway is made once rather than by every request that ran into the expired token. '''
+    def __init__(self, refresh_margin=5*60):
+        self.refresh_margin = refresh_margin
+        self._session = None
+        self._timer = None
+        self._lock = threading.RLock()
+
+    def get(self):
+        with self._lock:
+            if self._session is None:
+                # wrapped before the login, which refreshes the saved token if it expired
+                session = open_tidal_session(prepare=self._refresh_once)
+                self._session = session
+                self._schedule_refresh(session)
+            return self._session
+
+    def forget(self, session):
+        ''' Log in again the next time, once the refresh token stopped working '''
+        with self._lock:
+            if self._session is session:
+                self._session = None
+                if self._timer:
+                    self._timer.cancel()
+
+    def _refresh_once(self, session):
+        refresh = session.token_refresh
+        refresh_lock = threading.Lock()
+
+        @functools.wraps(refresh)
+        def token_refresh(refresh_token):
+            expired_token = session.access_token
+            with refresh_lock:
+                # another request that ran into the expired token refreshed it while this one waited, use its token
+                if session.access_token != expired_token:
+                    return True
+                if not refresh(refresh_token):
+                    self.forget(session)
+                    return False
+                save_tidal_session(session)
+            self._schedule_refresh(session)
+            return True
+
+        session.token_refresh = token_refresh
+
+    def _schedule_refresh(self, session):
+        # tidalapi keeps the expiry in naive UTC, it's unknown for sessions saved before it was kept
+        if session.expiry_time is None:
+            return
+        delay = (session.expiry_time - datetime.datetime.utcnow()).total_seconds() - self.refresh_margin
+        timer = threading.Timer(max(delay, 0), self._refresh, (session,))
+        timer.daemon = True
+        with self._lock:
+            if self._session not in (None, session):
+                return
+            if self._timer:
+                self._timer.cancel()
+            self._timer = timer
+        timer.start()
+
+    def _refresh(self, session):
+        try:
+            session.token_refresh(session.refresh_token)
+        except Exception as e:
+            # the next request that runs into the expired token refreshes it instead
+            print("Could not refresh the Tidal access token: " + str(e))
+
+_tidal_session_manager = TidalSessionManager()
+
+def get_tidal_session():
+    return _tidal_session_manager.get()
+
+def forget_tidal_session(session):
+    _tidal_session_manager.forget(session)
+
 
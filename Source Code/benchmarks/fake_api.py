@@ -0,0 +1,260 @@
+''' A local stand-in for the parts of the Spotify and Tidal web APIs that a sync uses.
+
+    spotipy and tidalapi are pointed at it through their base URLs, every request can be slowed down
+    by a configurable latency and answered with 429 Too Many Requests at a configurable rate. '''
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import json
+import random
+import re
+import threading
+import time
+import zlib
+
+def _tokens(text):
+    return set(re.findall(r"\w+", text.lower()))
+
+class FakeApi:
+    def __init__(self, fixture, latency=0.0, jitter=0.0, tidal_429_rate=0.0, spotify_429_rate=0.0, retry_after=1, seed=0):
+        self.fixture = fixture
+        self.latency = latency
+        self.jitter = jitter
+        self.tidal_429_rate = tidal_429_rate
+        self.spotify_429_rate = spotify_429_rate
+        self.retry_after = retry_after
+        self.requests = Counter()
+        self.throttled = Counter()
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.playlist_version = 0
+        self._albums = fixture["tidal_albums"]
+        self._tracks = {track_id: track for track_id, track in fixture["tidal_tracks"].items() if track["available"]}
+        self._by_isrc = {}
+        self._album_index = {}
+        self._track_index = {}
+        for track in self._tracks.values():
+            self._by_isrc.setdefault(track["isrc"], []).append(track["id"])
+            for token in _tokens(track["title"] + " " + " ".join(artist["name"] for artist in track["artists"])):
+                self._track_index.setdefault(token, set()).add(track["id"])
+        for album in self._albums.values():
+            for token in _tokens(album["title"] + " " + album["artist"]["name"]):
+                self._album_index.setdefault(token, set()).add(album["id"])
+        self.reset_playlist()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return "http://127.0.0.1:%d" % self._server.server_address[1]
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reset_playlist(self, track_ids=None):
+        ''' Put the Tidal playlist back to the fixture's contents, or to track_ids '''
+        with self._lock:
+            self.playlist_tracks = list(self.fixture["tidal_playlist"]["tracks"] if track_ids is None else track_ids)
+            self.playlist_version += 1
+
+    def reset_counters(self):
+        with self._lock:
+            self.requests.clear()
+            self.throttled.clear()
+            self.bytes_sent = 0
+
+    def bump_snapshot(self):
+        ''' Pretend the Spotify playlist was edited without changing its tracks '''
+        playlist = self.fixture["spotify_playlist"]
+        prefix, _, number = playlist["snapshot_id"].rpartition("-")
+        playlist["snapshot_id"] = "%s-%d" % (prefix, int(number) + 1)
+
+    # sessions pointed at the server
+
+    def spotify_session(self):
+        import spotipy
+        # spotipy retries 429s itself, honouring Retry-After, just like against the real service
+        session = spotipy.Spotify(auth="benchmark", requests_timeout=30, backoff_factor=0.01)
+        session.prefix = self.url + "/spotify/v1/"
+        return session
+
+    def tidal_session(self):
+        import tidalapi
+        config = tidalapi.Config()
+        config.api_location = self.url + "/tidal/v1/"
+        session = tidalapi.Session(config)
+        session.load_oauth_session("Bearer", "benchmark")
+        return session
+
+    # JSON the way the real services shape it
+
+    def _tidal_artist(self, artist):
+        return {"id": zlib.crc32(artist["id"].encode()), "name": artist["name"], "type": "MAIN", "picture": None}
+
+    def _tidal_album(self, album):
+        return {"id": album["id"], "title": album["title"], "cover": None, "videoCover": None,
+                "numberOfTracks": len(album["tracks"]), "artist": self._tidal_artist(album["artist"]),
+                "artists": [self._tidal_artist(album["artist"])]}
+
+    def _tidal_track(self, track):
+        album = self._albums[track["album_id"]]
+        artists = [self._tidal_artist(artist) for artist in track["artists"]]
+        return {"id": track["id"], "title": track["title"], "version": track["version"], "duration": track["duration"],
+                "isrc": track["isrc"], "trackNumber": track["track_number"], "volumeNumber": 1, "streamReady": True,
+                "explicit": False, "popularity": 0, "replayGain": 0.0, "peak": 1.0, "copyright": None,
+                "audioQuality": "LOSSLESS", "artist": artists[0], "artists": artists,
+                "album": {"id": album["id"], "title": album["title"], "cover": None, "videoCover": None}}
+
+    def _tidal_playlist(self):
+        playlist = self.fixture["tidal_playlist"]
+        return {"uuid": playlist["uuid"], "title": playlist["title"], "numberOfTracks": len(self.playlist_tracks),
+                "numberOfVideos": 0, "description": "", "duration": 0, "lastUpdated": None, "created": None,
+                "publicPlaylist": False, "popularity": 0, "type": "USER", "image": None, "squareImage": None,
+                "promotedArtists": [], "creator": {"id": 1}}
+
+    def _spotify_track(self, track):
+        return {"track": track}
+
+    # request handling
+
+    def _route(self, method, path, query, form, headers):
+        ''' Returns the endpoint pattern serving a request and a function answering it with (status, body, extra headers) '''
+        page_offset = int(query.get("offset", ["0"])[0])
+        page_limit = int(query.get("limit", ["100"])[0])
+        spotify_playlist = self.fixture["spotify_playlist"]
+        etag = '"%d"' % self.playlist_version
+        routes = (
+            ("GET", r"/spotify/v1/playlists/[^/]+", lambda: (200, dict(spotify_playlist, tracks={"total": len(self.fixture["spotify_tracks"])}), {})),
+            ("GET", r"/spotify/v1/playlists/[^/]+/tracks", lambda: (200, {
+                "items": [self._spotify_track(track) for track in self.fixture["spotify_tracks"][page_offset:page_offset + page_limit]],
+                "total": len(self.fixture["spotify_tracks"]), "offset": page_offset, "limit": page_limit,
+                "next": None if page_offset + page_limit >= len(self.fixture["spotify_tracks"]) else
+                        "%s/spotify/v1/playlists/%s/tracks?offset=%d&limit=%d" % (self.url, spotify_playlist["id"], page_offset + page_limit, page_limit)}, {})),
+            ("GET", r"/spotify/v1/me/playlists", lambda: (200, {
+                "items": [{"id": spotify_playlist["id"], "name": spotify_playlist["name"], "images": []}][page_offset:page_offset + page_limit],
+                "total": 1, "next": None}, {})),
+            ("GET", r"/tidal/v1/sessions", lambda: (200, {"sessionId": "benchmark", "countryCode": "US", "userId": 1}, {})),
+            ("GET", r"/tidal/v1/users/\d+", lambda: (200, {"id": 1, "username": "benchmark", "email": "benchmark@localhost",
+                                                            "firstName": "Bench", "lastName": "Mark"}, {})),
+            ("GET", r"/tidal/v1/users/\d+/subscription", lambda: (200, {}, {})),
+            ("GET", r"/tidal/v1/users/\d+/playlists", lambda: (200, {"items": [self._tidal_playlist()]}, {})),
+            ("GET", r"/tidal/v1/search", lambda: (200, self._search(query), {})),
+            ("GET", r"/tidal/v1/tracks", lambda: (200, {"items": [self._tidal_track(self._tracks[track_id])
+                                                                 for track_id in self._by_isrc.get(query.get("isrc", [""])[0], [])]}, {})),
+            ("GET", r"/tidal/v1/albums/\d+/tracks", lambda: (200, {"items": [self._tidal_track(self._tracks[track_id])
+                                                                            for track_id in self._albums[int(path.split("/")[4])]["tracks"]
+                                                                            if track_id in self._tracks]}, {})),
+            ("GET", r"/tidal/v1/playlists/[^/]+", lambda: (200, self._tidal_playlist(), {"ETag": etag})),
+            ("GET", r"/tidal/v1/playlists/[^/]+/tracks", lambda: (200, {
+                "items": [self._tidal_track(self._tracks[track_id]) for track_id in self.playlist_tracks[page_offset:page_offset + page_limit]],
+                "totalNumberOfItems": len(self.playlist_tracks), "offset": page_offset, "limit": page_limit}, {"ETag": etag})),
+            ("POST", r"/tidal/v1/playlists/[^/]+/items", lambda: self._add(form, headers)),
+            ("DELETE", r"/tidal/v1/playlists/[^/]+/items/[\d,]+", lambda: self._delete(path, headers)),
+        )
+        for route_method, pattern, handle in routes:
+            if route_method == method and re.fullmatch(pattern, path):
+                return pattern, handle
+        return path, None
+
+    def _search(self, query):
+        words = _tokens(query.get("query", [""])[0])
+        limit = int(query.get("limit", ["50"])[0])
+        types = query.get("types", [""])[0].upper().split(",")
+        result = {kind: {"items": []} for kind in ("artists", "albums", "tracks", "videos", "playlists")}
+        result["topHit"] = None
+        for kind, index, build, items in (("ALBUMS", self._album_index, self._tidal_album, self._albums),
+                                          ("TRACKS", self._track_index, self._tidal_track, self._tracks)):
+            if kind not in types or not words:
+                continue
+            hits = Counter()
+            for word in words:
+                hits.update(index.get(word, ()))
+            ranked = [item_id for item_id, count in hits.most_common(limit) if count >= len(words) - 1]
+            result[kind.lower()]["items"] = [build(items[item_id]) for item_id in ranked]
+        return result
+
+    def _check_etag(self, headers):
+        expected = headers.get("If-None-Match")
+        return expected is None or expected == '"%d"' % self.playlist_version
+
+    def _add(self, form, headers):
+        with self._lock:
+            if not self._check_etag(headers):
+                return 412, {"userMessage": "The playlist has been modified"}, {}
+            track_ids = [int(track_id) for track_id in form.get("trackIds", [""])[0].split(",") if track_id]
+            index = int(form.get("toIndex", [len(self.playlist_tracks)])[0])
+            self.playlist_tracks[index:index] = [track_id for track_id in track_ids if track_id in self._tracks]
+            self.playlist_version += 1
+            return 200, {"lastUpdated": self.playlist_version}, {"ETag": '"%d"' % self.playlist_version}
+
+    def _delete(self, path, headers):
+        with self._lock:
+            if not self._check_etag(headers):
+                return 412, {"userMessage": "The playlist has been modified"}, {}
+            for index in sorted(map(int, path.rsplit("/", 1)[1].split(",")), reverse=True):
+                if index < len(self.playlist_tracks):
+                    del self.playlist_tracks[index]
+            self.playlist_version += 1
+            return 200, {}, {"ETag": '"%d"' % self.playlist_version}
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            # headers and body go out in separate writes, don't let Nagle hold the body back
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _serve(self, method):
+                url = urlparse(self.path)
+                length = int(self.headers.get("Content-Length") or 0)
+                form = parse_qs(self.rfile.read(length).decode()) if length else {}
+                if api.latency or api.jitter:
+                    time.sleep(api.latency + api.jitter*api._random.random())
+                service = "tidal" if url.path.startswith("/tidal/") else "spotify"
+                throttle_rate = api.tidal_429_rate if service == "tidal" else api.spotify_429_rate
+                endpoint, handle = api._route(method, url.path, parse_qs(url.query), form, self.headers)
+                endpoint = "%s %s" % (method, endpoint)
+                with api._lock:
+                    api.requests[endpoint] += 1
+                    throttled = throttle_rate and api._random.random() < throttle_rate
+                    if throttled:
+                        api.throttled[endpoint] += 1
+                # a throttled request must not reach the handler, it would still apply playlist edits
+                if handle is None:
+                    status, body, headers = 404, {"error": "not found"}, {}
+                elif throttled:
+                    status, body, headers = 429, {"userMessage": "Too many requests"}, {"Retry-After": "%d" % api.retry_after}
+                else:
+                    status, body, headers = handle()
+                payload = json.dumps(body).encode()
+                with api._lock:
+                    api.bytes_sent += len(payload)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def do_DELETE(self):
+                self._serve("DELETE")
+
+        return Handler
@@ -0,0 +1,92 @@
+import json
+import random
+
+# playlist sizes the benchmarks are usually run at
+FIXTURE_SIZES = (100, 1000, 5000, 20000)
+
+_WORDS = ("love", "night", "fire", "dream", "heart", "road", "blue", "gold", "rain", "summer", "ghost", "river",
+          "light", "wild", "city", "echo", "storm", "dance", "shadow", "silver", "ocean", "café", "señor", "über")
+_VERSIONS = (None, None, None, None, "Remastered", "Radio Edit", "Live", "Remix", "Instrumental")
+
+def _title(rng, words):
+    return " ".join(rng.choice(_WORDS) for _ in range(words)).title()
+
+def make_fixture(size, seed=0, in_playlist=0.5, on_tidal=0.95, with_isrc=0.9, tracks_per_album=12):
+    ''' Build a synthetic Spotify playlist of size tracks together with the Tidal catalog it syncs against.
+
+        in_playlist: share of the tracks already in the Tidal playlist
+        on_tidal:    share of the tracks Tidal has at all
+        with_isrc:   share of the Spotify tracks carrying an ISRC '''
+    rng = random.Random(seed)
+    prefix = "b%d" % size
+    albums = []
+    tidal_albums = {}
+    tidal_tracks = {}
+    spotify_tracks = []
+    artist_count = max(size // 40, 5)
+    artists = [{"id": "%s-artist-%d" % (prefix, i), "name": _title(rng, 2)} for i in range(artist_count)]
+    track_id = 100000000 + size*100000
+    album_id = 200000000 + size*10000
+    while len(spotify_tracks) < size:
+        album_artist = rng.choice(artists)
+        album_name = _title(rng, rng.randint(1, 3))
+        album_id += 1
+        album = {"id": album_id, "title": album_name, "artist": album_artist, "tracks": []}
+        albums.append(album)
+        tidal_albums[album_id] = album
+        for number in range(1, tracks_per_album + 1):
+            if len(spotify_tracks) >= size:
+                break
+            track_id += 1
+            name = _title(rng, rng.randint(1, 4))
+            version = rng.choice(_VERSIONS)
+            track_artists = [album_artist] + ([rng.choice(artists)] if rng.random() < 0.2 else [])
+            duration = rng.randint(120, 420)
+            isrc = "QZ%05d%06d" % (size, len(spotify_tracks))
+            spotify_name = name + (" - " + version if version else "")
+            spotify_track = {
+                "id": "%ssp%d" % (prefix, len(spotify_tracks)),
+                "name": spotify_name,
+                "album": {"name": album_name, "artists": [{"name": album_artist["name"]}]},
+                "artists": [{"name": artist["name"]} for artist in track_artists],
+                "track_number": number,
+                "duration_ms": duration*1000 + rng.randint(-900, 900),
+                "external_ids": {"isrc": isrc} if rng.random() < with_isrc else {},
+            }
+            spotify_tracks.append(spotify_track)
+            tidal_track = {
+                "id": track_id,
+                "title": name,
+                "version": version,
+                "duration": duration,
+                "isrc": isrc,
+                "track_number": number,
+                "album_id": album_id,
+                "artists": track_artists,
+                "available": rng.random() < on_tidal,
+            }
+            tidal_tracks[track_id] = tidal_track
+            album["tracks"].append(track_id)
+    in_tidal_playlist = [album_track for album in albums for album_track in album["tracks"]
+                         if tidal_tracks[album_track]["available"] and rng.random() < in_playlist]
+    return {
+        "spotify_playlist": {"id": "%splaylist" % prefix, "name": "Benchmark %d" % size,
+                             "description": "synthetic benchmark playlist", "snapshot_id": "%s-snapshot-1" % prefix},
+        "spotify_tracks": spotify_tracks,
+        "tidal_albums": tidal_albums,
+        "tidal_tracks": tidal_tracks,
+        "tidal_playlist": {"uuid": "%s-tidal-playlist" % prefix, "title": "Benchmark %d" % size, "tracks": in_tidal_playlist},
+    }
+
+def save_fixture(fixture, path):
+    with open(path, 'w') as f:
+        json.dump(fixture, f)
+
+def load_fixture(path):
+    ''' Load a fixture saved with save_fixture, or recorded from the live services in the same shape '''
+    with open(path, 'r') as f:
+        fixture = json.load(f)
+    # JSON turns the integer ids used as keys into strings
+    fixture["tidal_albums"] = {int(key): value for key, value in fixture["tidal_albums"].items()}
+    fixture["tidal_tracks"] = {int(key): value for key, value in fixture["tidal_tracks"].items()}
+    return fixture
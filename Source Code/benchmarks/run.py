@@ -0,0 +1,260 @@
+''' Offline benchmarks for the sync engine, run against a local fake of the Spotify and Tidal APIs.
+
+    python benchmarks/run.py --sizes 100 1000 5000 --latency 0.02 --tidal-429-rate 0.01 --json results.json
+
+    For every playlist size it reports the throughput, the p50/p99 latency and the number of API
+    requests (per endpoint and throttled) of the hot paths of a sync. '''
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+# run from anywhere: the engine lives one directory up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_api import FakeApi
+from fixtures import FIXTURE_SIZES, load_fixture, make_fixture
+from rate_limit import get_rate_limiter, limit_tidal_session
+from search_cache import clear_search_cache
+from search_engine import get_search_engine, share_tidal_session
+from sync_engine import TidalPlaylistCache, match, repeat_on_request_error, sync_playlist, tidal_search
+from tidalapi_patch import PlaylistSnapshot, set_tidal_playlist
+from track_key import TrackKey, spotify_track_key
+import scoring
+
+BENCHMARKS = ('match', 'scoring', 'playlist_cache', 'tidal_search', 'sync_playlist', 'set_tidal_playlist')
+
+def percentile(samples, q):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(q*(len(ordered) - 1))))]
+
+def result(name, size, operations, elapsed, samples, api=None, **extra):
+    ''' One row of the report, latencies in milliseconds '''
+    row = {
+        'benchmark': name,
+        'size': size,
+        'operations': operations,
+        'seconds': round(elapsed, 4),
+        'throughput': round(operations/elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(samples, 0.5)*1000, 3) if samples else None,
+        'p99_ms': round(percentile(samples, 0.99)*1000, 3) if samples else None,
+    }
+    if api is not None:
+        row['requests'] = sum(api.requests.values())
+        row['throttled'] = sum(api.throttled.values())
+        row['bytes'] = api.bytes_sent
+        row['endpoints'] = dict(api.requests)
+    row.update(extra)
+    return row
+
+@contextlib.contextmanager
+def quiet():
+    # the engine reports progress with print, which would drown the results
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+def spotify_copies(fixture):
+    # match keys get cached in the track dicts, keep them out of the fixture the fake API serialises
+    return [dict(track) for track in fixture['spotify_tracks']]
+
+def tidal_key(track):
+    return TrackKey(track['title'], [artist['name'] for artist in track['artists']], track['duration'], track['isrc'], track['version'])
+
+def bench_match(fixture, args, api):
+    ''' Every spotify track against its own tidal track and 9 others, as the album and track searches do '''
+    rng = random.Random(args.seed)
+    tidal_keys = {track_id: tidal_key(track) for track_id, track in fixture['tidal_tracks'].items()}
+    all_keys = list(tidal_keys.values())
+    pairs = []
+    for spotify_track, track_id in zip(spotify_copies(fixture), fixture['tidal_tracks']):
+        candidates = [tidal_keys[track_id]] + rng.sample(all_keys, min(9, len(all_keys)))
+        pairs.append((spotify_track_key(spotify_track), candidates))
+    samples = []
+    comparisons = 0
+    start = time.perf_counter()
+    for spotify_key, candidates in pairs:
+        call_start = time.perf_counter()
+        for candidate in candidates:
+            match(candidate, spotify_key)
+        samples.append(time.perf_counter() - call_start)
+        comparisons += len(candidates)
+    return result('match', len(fixture['spotify_tracks']), comparisons, time.perf_counter() - start, samples,
+                  unit='per spotify track against its candidates')
+
+def bench_scoring(fixture, args, api):
+    ''' Every spotify track scored against a batch of --candidates tidal tracks including its own, with and without numpy '''
+    rng = random.Random(args.seed)
+    tidal_keys = [tidal_key(track) for track in fixture['tidal_tracks'].values()]
+    spotify_keys = [spotify_track_key(track) for track in spotify_copies(fixture)]
+    size = min(args.candidates, len(tidal_keys))
+    batches = [[tidal_keys[index]] + rng.sample(tidal_keys, size - 1) for index in range(len(spotify_keys))]
+    rows = []
+    for vectorized in (False, True):
+        if vectorized and scoring.numpy is None:
+            continue
+        cutoff, scoring.NUMPY_MIN_CANDIDATES = scoring.NUMPY_MIN_CANDIDATES, 0 if vectorized else len(tidal_keys) + 1
+        try:
+            prepared = [scoring.CandidateBatch(batch) for batch in batches]
+            samples = []
+            start = time.perf_counter()
+            for spotify_key, batch in zip(spotify_keys, prepared):
+                call_start = time.perf_counter()
+                batch.best_match(spotify_key, match)
+                samples.append(time.perf_counter() - call_start)
+            elapsed = time.perf_counter() - start
+        finally:
+            scoring.NUMPY_MIN_CANDIDATES = cutoff
+        rows.append(result('scoring:' + ('numpy' if vectorized else 'python'), len(spotify_keys), len(spotify_keys)*size,
+                           elapsed, samples, unit='candidates per second, latency per batch'))
+    return rows
+
+def bench_playlist_cache(fixture, args, api):
+    ''' Building the playlist cache from the Tidal playlist and looking every spotify track up in it '''
+    tidal_session = api.tidal_session()
+    api.reset_playlist()
+    api.reset_counters()
+    start = time.perf_counter()
+    cache = TidalPlaylistCache(PlaylistSnapshot.fetch(tidal_session.playlist(fixture['tidal_playlist']['uuid'])))
+    build = time.perf_counter() - start
+    samples = []
+    spotify_tracks = spotify_copies(fixture)
+    start = time.perf_counter()
+    for spotify_track in spotify_tracks:
+        call_start = time.perf_counter()
+        cache.search([spotify_track])
+        samples.append(time.perf_counter() - call_start)
+    return result('playlist_cache', len(spotify_tracks), len(spotify_tracks), time.perf_counter() - start, samples, api,
+                  build_seconds=round(build, 4), unit='per lookup, requests are the cache build')
+
+def bench_tidal_search(fixture, args, api):
+    ''' Cold searches for a sample of the playlist, run on the search engine like a sync does '''
+    tidal_session = share_tidal_session(api.tidal_session(), args.concurrency)
+    limit_tidal_session(tidal_session, get_rate_limiter(engine_config(args)))
+    engine = get_search_engine(engine_config(args))
+    sample = spotify_copies(fixture)[:args.search_sample]
+    clear_search_cache()
+    api.reset_counters()
+    samples = []
+    def timed_search(spotify_track):
+        call_start = time.perf_counter()
+        track = repeat_on_request_error(tidal_search, (spotify_track, None), tidal_session)
+        samples.append(time.perf_counter() - call_start)
+        return track
+    start = time.perf_counter()
+    # stdout is swapped for the whole process, so only ever from this thread
+    with quiet():
+        found = sum(1 for index, track in engine.imap_unordered(timed_search, sample) if track is not None)
+    elapsed = time.perf_counter() - start
+    clear_search_cache()
+    return result('tidal_search', len(fixture['spotify_tracks']), len(sample), elapsed, samples, api,
+                  found=found, requests_per_track=round(sum(api.requests.values())/max(len(sample), 1), 2))
+
+def bench_sync_playlist(fixture, args, api):
+    ''' A whole playlist sync: cold, again after the spotify snapshot changed, and with nothing changed '''
+    spotify_session = api.spotify_session()
+    tidal_session = share_tidal_session(api.tidal_session(), args.concurrency)
+    limit_tidal_session(tidal_session, get_rate_limiter(engine_config(args)))
+    rows = []
+    with tempfile.TemporaryDirectory() as state_dir:
+        for run in range(args.repeat):
+            config = engine_config(args, state_file=os.path.join(state_dir, 'state-%d.db' % run))
+            api.reset_playlist()
+            for scenario in ('cold', 'snapshot_changed', 'unchanged'):
+                if scenario == 'snapshot_changed':
+                    api.bump_snapshot()
+                clear_search_cache()
+                get_search_engine(config).forget_shared()
+                api.reset_counters()
+                start = time.perf_counter()
+                with quiet():
+                    sync_playlist(spotify_session, tidal_session, fixture['spotify_playlist']['id'],
+                                  fixture['tidal_playlist']['uuid'], config)
+                elapsed = time.perf_counter() - start
+                rows.append(result('sync_playlist:' + scenario, len(fixture['spotify_tracks']), len(fixture['spotify_tracks']),
+                                   elapsed, [elapsed], api, playlist_length=len(api.playlist_tracks)))
+    clear_search_cache()
+    return rows
+
+def bench_set_tidal_playlist(fixture, args, api):
+    ''' Writing a small change (3 tracks added, 2 removed) to the Tidal playlist '''
+    rng = random.Random(args.seed)
+    tidal_session = api.tidal_session()
+    available = [track_id for track_id, track in fixture['tidal_tracks'].items() if track['available']]
+    base = list(fixture['tidal_playlist']['tracks'])
+    samples = []
+    api.reset_counters()
+    start = time.perf_counter()
+    for run in range(args.repeat):
+        target = list(base)
+        for _ in range(min(2, len(target))):
+            del target[rng.randrange(len(target))]
+        for track_id in rng.sample(available, 3):
+            target.insert(rng.randint(0, len(target)), track_id)
+        api.reset_playlist(base)
+        call_start = time.perf_counter()
+        with quiet():
+            set_tidal_playlist(tidal_session.playlist(fixture['tidal_playlist']['uuid']), target, old_track_ids=base)
+        samples.append(time.perf_counter() - call_start)
+        if api.playlist_tracks != target:
+            raise AssertionError("set_tidal_playlist left the playlist in the wrong state")
+    return result('set_tidal_playlist', len(base), args.repeat, time.perf_counter() - start, samples, api,
+                  requests_per_write=round(sum(api.requests.values())/args.repeat, 2))
+
+def engine_config(args, **overrides):
+    config = {'concurrency': args.concurrency}
+    if args.requests_per_second:
+        config['requests_per_second'] = args.requests_per_second
+        config['request_burst'] = args.requests_per_second
+    config.update(overrides)
+    return config
+
+def print_row(row):
+    print("{:<30} {:>6} {:>10} {:>12} {:>10} {:>10} {:>9} {:>9}".format(
+        row['benchmark'], row['size'], row['operations'], row['throughput'] if row['throughput'] is not None else '-',
+        row['p50_ms'] if row['p50_ms'] is not None else '-', row['p99_ms'] if row['p99_ms'] is not None else '-',
+        row.get('requests', '-'), row.get('throttled', '-')))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000], help="playlist sizes, e.g. %s" % ' '.join(map(str, FIXTURE_SIZES)))
+    parser.add_argument('--fixture', help="use a fixture saved with fixtures.save_fixture instead of generated ones")
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=BENCHMARKS)
+    parser.add_argument('--latency', type=float, default=0.0, help="seconds added to every API response")
+    parser.add_argument('--jitter', type=float, default=0.0, help="up to this many extra seconds per response")
+    parser.add_argument('--tidal-429-rate', type=float, default=0.0)
+    parser.add_argument('--spotify-429-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=int, default=1, help="seconds sent in Retry-After with a 429")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--requests-per-second', type=float, help="cap the Tidal request rate, by default only 429s set the pace")
+    parser.add_argument('--candidates', type=int, default=50, help="candidates per batch in the scoring benchmark")
+    parser.add_argument('--search-sample', type=int, default=200, help="tracks searched by the tidal_search benchmark")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args(argv)
+
+    fixtures = [load_fixture(args.fixture)] if args.fixture else [make_fixture(size, seed=args.seed) for size in args.sizes]
+    rows = []
+    print("{:<30} {:>6} {:>10} {:>12} {:>10} {:>10} {:>9} {:>9}".format(
+        'benchmark', 'size', 'ops', 'ops/s', 'p50 ms', 'p99 ms', 'requests', '429s'))
+    for fixture in fixtures:
+        with FakeApi(fixture, latency=args.latency, jitter=args.jitter, tidal_429_rate=args.tidal_429_rate,
+                     spotify_429_rate=args.spotify_429_rate, retry_after=args.retry_after, seed=args.seed) as api:
+            for name in args.only:
+                output = globals()['bench_' + name](fixture, args, api)
+                for row in output if isinstance(output, list) else [output]:
+                    print_row(row)
+                    rows.append(row)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'arguments': vars(args), 'results': rows}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
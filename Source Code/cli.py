@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+''' Headless sync runner for cron, systemd timers and containers, without any of the GUI toolkits.
+
+    python cli.py one <spotify playlist id>
+    python cli.py many <id> [<id> ...] [--file ids.txt]
+    python cli.py all [--owned]
+    python cli.py schedule
+    python cli.py daemon
+
+    config.yml, .session.yml and the sync state are read from the working directory, or from --directory. '''
+import argparse
+import os
+import sys
+
+# the sync engine pulls in spotipy, tidalapi and requests, so it is only imported once a command runs
+
+def sync_one(args):
+    from sync_engine import sync
+    sync(args.id)
+
+def sync_many(args):
+    ids = list(args.ids)
+    if args.file:
+        with open(args.file, 'r') as f:
+            ids.extend(line.strip() for line in f if line.strip() and not line.startswith('#'))
+    from sync_engine import sync_many
+    sync_many(ids)
+
+def sync_all(args):
+    from sync_engine import sync_library
+    sync_library(owned_only=args.owned)
+
+def sync_schedule(args):
+    from sync_schedule import sync_due
+    sync_due()
+
+def run_daemon(args):
+    from sync_schedule import Scheduler
+    scheduler = Scheduler(coalesce=args.coalesce, rescan=args.rescan, retry=args.retry)
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='tyspidal', description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-C', '--directory', help="run in this directory instead of the current one")
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('one', help="sync a single Spotify playlist")
+    command.add_argument('id', help="Spotify playlist ID or URL")
+    command.set_defaults(run=sync_one)
+    command = commands.add_parser('many', help="sync several Spotify playlists in one run")
+    command.add_argument('ids', nargs='*', help="Spotify playlist IDs or URLs")
+    command.add_argument('-f', '--file', help="also sync the IDs in this file, one per line")
+    command.set_defaults(run=sync_many)
+    command = commands.add_parser('all', help="sync every playlist in the Spotify library")
+    command.add_argument('--owned', action='store_true', help="only the playlists the user owns, not those they follow")
+    command.set_defaults(run=sync_all)
+    command = commands.add_parser('schedule', help="sync every playlist in the schedule of config.yml that is due")
+    command.set_defaults(run=sync_schedule)
+    command = commands.add_parser('daemon', help="stay running and sync the scheduled playlists whenever they are due")
+    command.add_argument('--coalesce', type=float, default=60, help="sync playlists due within this many seconds of each other together")
+    command.add_argument('--rescan', type=float, default=60, help="seconds between checks of config.yml for schedule changes")
+    command.add_argument('--retry', type=float, default=600, help="seconds before a failed sync is tried again")
+    command.set_defaults(run=run_daemon)
+    args = parser.parse_args(argv)
+    if args.directory:
+        os.chdir(args.directory)
+    args.run(args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
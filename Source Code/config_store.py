@@ -0,0 +1,58 @@
+from atomic_write import locked, write_atomically
+import copy
+import os
+import threading
+import yaml
+
+CONFIG_FILE = 'config.yml'
+
+class ConfigStore:
+    ''' config.yml, read once and then again only when the file changes. Updates re-read it under a lock shared
+        with the other processes and replace it in one go, so the GUI and the scheduled syncs can't undo each
+        other's changes or read half a file. '''
+    def __init__(self, path=CONFIG_FILE):
+        self.path = path
+        self._config = {}
+        self._version = None
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._config, self._version = {}, None
+            return self._config
+        # the size as well, in case the file system's timestamps are too coarse to tell two writes apart
+        version = (stat.st_mtime_ns, stat.st_size)
+        if version != self._version:
+            with open(self.path, 'r') as f:
+                self._config = yaml.safe_load(f) or {}
+            self._version = version
+        return self._config
+
+    def load(self):
+        ''' A copy of the config, to change as the caller pleases '''
+        with self._lock:
+            return copy.deepcopy(self._read())
+
+    def update(self, change):
+        ''' Call change(config) on the latest config and write the result back '''
+        with self._lock, locked(self.path):
+            config = copy.deepcopy(self._read())
+            change(config)
+            write_atomically(self.path, yaml.dump(config, default_flow_style=False))
+            self._config = config
+            stat = os.stat(self.path)
+            self._version = (stat.st_mtime_ns, stat.st_size)
+            return copy.deepcopy(config)
+
+_config_stores = {}
+_config_stores_lock = threading.Lock()
+
+def get_config_store(path=CONFIG_FILE):
+    # by absolute path, the working directory can change between calls
+    path = os.path.abspath(path)
+    with _config_stores_lock:
+        if path not in _config_stores:
+            _config_stores[path] = ConfigStore(path)
+        return _config_stores[path]
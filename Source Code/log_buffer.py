@@ -0,0 +1,34 @@
+from collections import deque
+import threading
+
+class LogBuffer:
+    ''' A file-like ring buffer for print() output. Writers only append to a deque under a short lock, and the
+        oldest lines are dropped once it holds max_lines, so a chatty sync never waits on whoever reads it. '''
+    def __init__(self, max_lines=2000):
+        self._lines = deque(maxlen=max_lines)
+        self._partial = ''
+        self._dropped = 0
+        self._lock = threading.Lock()
+
+    def write(self, text):
+        with self._lock:
+            lines = (self._partial + text).split('\n')
+            self._partial = lines.pop()
+            overflow = len(self._lines) + len(lines) - self._lines.maxlen
+            if overflow > 0:
+                self._dropped += overflow
+            self._lines.extend(lines)
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        ''' Everything written since the last drain as one string, with a note of the lines that were dropped '''
+        with self._lock:
+            lines = list(self._lines)
+            self._lines.clear()
+            dropped, self._dropped = self._dropped, 0
+        if dropped:
+            lines.insert(0, "... {} lines skipped ...".format(dropped))
+        return ''.join(line + '\n' for line in lines)
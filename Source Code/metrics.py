@@ -0,0 +1,157 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import datetime
+import json
+import re
+import threading
+import time
+from urllib.parse import urlparse
+from atomic_write import write_atomically
+import search_cache
+
+# ids in API paths, so requests are counted per endpoint rather than per track or playlist
+_ID_PATTERN = re.compile(r'/(\d[\d,]*|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}|[0-9A-Za-z]{22})(?=/|$)')
+
+def endpoint_name(response):
+    request = response.request
+    url = urlparse(request.url)
+    return "{} {}{}".format(request.method, url.netloc, _ID_PATTERN.sub('/{id}', url.path))
+
+_DONE = object()
+
+class SyncMetrics:
+    ''' Timings and counters of one sync run, shared by every thread taking part in it '''
+    def __init__(self):
+        self.started = time.time()
+        self.phases = defaultdict(float)
+        self.playlist_phases = defaultdict(lambda: defaultdict(float))
+        self.counters = Counter()
+        self.requests = Counter()
+        self.retries = Counter()
+        self.errors = Counter()
+        self.bytes = Counter()
+        self.sleep_seconds = 0.0
+        self._lock = threading.Lock()
+        # the search caches live for the whole process, only count what this run added
+        self._cache_baseline = {name: (cache.hits, cache.misses) for name, cache in _caches()}
+
+    @contextmanager
+    def phase(self, name, playlist=None):
+        ''' Time the body of the with statement as part of the named phase, also per playlist if one is given '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.phases[name] += elapsed
+                if playlist is not None:
+                    self.playlist_phases[playlist][name] += elapsed
+
+    def timed(self, iterable, name, playlist=None):
+        ''' Yield from iterable, timing the wait for each item as part of the named phase '''
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name, playlist):
+                item = next(iterator, _DONE)
+            if item is _DONE:
+                return
+            yield item
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def add_sleep(self, seconds):
+        with self._lock:
+            self.sleep_seconds += seconds
+
+    def record_response(self, response):
+        endpoint = endpoint_name(response)
+        with self._lock:
+            self.requests[endpoint] += 1
+            self.bytes[endpoint] += len(response.content or b'')
+            if response.status_code == 429:
+                self.retries[endpoint] += 1
+            elif response.status_code >= 400:
+                self.errors[endpoint] += 1
+
+    def summary(self):
+        with self._lock:
+            caches = {}
+            for name, cache in _caches():
+                hits, misses = cache.hits - self._cache_baseline[name][0], cache.misses - self._cache_baseline[name][1]
+                caches[name] = {'hits': hits, 'misses': misses, 'hit_rate': round(hits/(hits + misses), 4) if hits + misses else None}
+            return {
+                'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'duration_seconds': round(time.time() - self.started, 3),
+                'phases_seconds': {name: round(seconds, 3) for name, seconds in self.phases.items()},
+                'playlists': {playlist: {name: round(seconds, 3) for name, seconds in phases.items()}
+                              for playlist, phases in self.playlist_phases.items()},
+                'counters': dict(self.counters),
+                'requests': {endpoint: {'count': count, 'retries': self.retries[endpoint],
+                                        'errors': self.errors[endpoint], 'bytes': self.bytes[endpoint]}
+                             for endpoint, count in sorted(self.requests.items())},
+                'caches': caches,
+                'retry_sleep_seconds': round(self.sleep_seconds, 3),
+            }
+
+def _caches():
+    return (('search_results', search_cache.search_results), ('album_tracks', search_cache.album_tracks),
+            ('candidate_batches', search_cache.candidate_batches))
+
+def _prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def prometheus_text(summary):
+    ''' The summary in the Prometheus text exposition format, for the node exporter's textfile collector '''
+    lines = ['# TYPE tyspidal_sync_duration_seconds gauge',
+             'tyspidal_sync_duration_seconds {}'.format(summary['duration_seconds']),
+             '# TYPE tyspidal_sync_phase_seconds gauge']
+    for phase, seconds in summary['phases_seconds'].items():
+        lines.append('tyspidal_sync_phase_seconds{{phase="{}"}} {}'.format(_prometheus_label(phase), seconds))
+    lines.append('# TYPE tyspidal_sync_retry_sleep_seconds gauge')
+    lines.append('tyspidal_sync_retry_sleep_seconds {}'.format(summary['retry_sleep_seconds']))
+    lines.append('# TYPE tyspidal_sync_events gauge')
+    for name, count in summary['counters'].items():
+        lines.append('tyspidal_sync_events{{event="{}"}} {}'.format(_prometheus_label(name), count))
+    for metric, field in (('requests', 'count'), ('request_retries', 'retries'), ('request_errors', 'errors'), ('response_bytes', 'bytes')):
+        lines.append('# TYPE tyspidal_sync_{} gauge'.format(metric))
+        for endpoint, values in summary['requests'].items():
+            lines.append('tyspidal_sync_{}{{endpoint="{}"}} {}'.format(metric, _prometheus_label(endpoint), values[field]))
+    lines.append('# TYPE tyspidal_sync_cache_hit_rate gauge')
+    for name, cache in summary['caches'].items():
+        if cache['hit_rate'] is not None:
+            lines.append('tyspidal_sync_cache_hit_rate{{cache="{}"}} {}'.format(name, cache['hit_rate']))
+    lines.append('# TYPE tyspidal_sync_last_run_timestamp_seconds gauge')
+    lines.append('tyspidal_sync_last_run_timestamp_seconds {}'.format(int(time.time())))
+    return '\n'.join(lines) + '\n'
+
+def write_metrics(metrics, config):
+    ''' Write the summary of a run to the JSON file and, if configured, the Prometheus text file '''
+    summary = metrics.summary()
+    write_atomically(config.get('metrics_file', '.sync_metrics.json'), json.dumps(summary, indent=2))
+    if config.get('prometheus_file'):
+        write_atomically(config['prometheus_file'], prometheus_text(summary))
+    return summary
+
+# the metrics of the run in progress
+_metrics = SyncMetrics()
+
+def get_metrics():
+    return _metrics
+
+def start_metrics():
+    ''' Start counting a new run '''
+    global _metrics
+    _metrics = SyncMetrics()
+    return _metrics
+
+def _record_response(response, *args, **kwargs):
+    _metrics.record_response(response)
+
+def instrument_session(request_session):
+    ''' Count every response of a requests session in the metrics of the run in progress '''
+    if _record_response not in request_session.hooks['response']:
+        request_session.hooks['response'].append(_record_response)
+    return request_session
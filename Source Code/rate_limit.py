@@ -0,0 +1,127 @@
+from email.utils import parsedate_to_datetime
+import datetime
+import functools
+import math
+import random
+import threading
+import time
+
+class RateLimiter:
+    ''' Token bucket shared by every Tidal request, combined with a concurrency window that grows by
+        one request per window of successes and halves whenever Tidal answers 429 (AIMD). Without a rate
+        there is no bucket, the window and the Retry-After pauses alone find the pace Tidal allows. '''
+    def __init__(self, rate=None, burst=20, max_concurrency=16, min_concurrency=1, default_retry_after=2):
+        self.rate = rate or math.inf
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.default_retry_after = default_retry_after
+        self.window = float(max_concurrency)
+        self.throttled = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0
+        self._active = 0
+        self._condition = threading.Condition()
+
+    def _refill(self, now):
+        if self.rate == math.inf:
+            self._tokens = max(self.burst, 1)
+        else:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated)*self.rate)
+        self._updated = now
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._active >= int(self.window):
+                    wait = None # until another request finishes
+                elif self._tokens < 1:
+                    wait = (1 - self._tokens)/self.rate
+                else:
+                    self._tokens -= 1
+                    self._active += 1
+                    return
+                self._condition.wait(wait)
+
+    def release(self, retry_after=None):
+        ''' Give the slot back, retry_after is the number of seconds Tidal asked us to back off for if it throttled the request '''
+        with self._condition:
+            self._active -= 1
+            if retry_after is None:
+                self.window = min(self.max_concurrency, self.window + 1/self.window)
+            else:
+                self.throttled += 1
+                self.window = max(self.min_concurrency, self.window/2)
+                self._paused_until = max(self._paused_until, time.monotonic() + retry_after)
+                self._tokens = 0
+            self._condition.notify_all()
+
+    def retry_after(self, response):
+        value = response.headers.get('Retry-After')
+        if not value:
+            return self.default_retry_after
+        try:
+            return max(float(value), 0)
+        except ValueError:
+            pass
+        try:
+            return max((parsedate_to_datetime(value) - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 0)
+        except (TypeError, ValueError):
+            return self.default_retry_after
+
+# seconds to connect and between bytes of a response
+REQUEST_TIMEOUT = 30
+
+def backoff_delay(attempt, base=1, cap=60):
+    ''' Exponential backoff with full jitter: a random delay of up to base*2**attempt seconds, at most cap.
+        The jitter keeps items that failed together from all coming back at the same moment. '''
+    return random.uniform(0, min(cap, base*2**attempt))
+
+def limit_tidal_session(tidal_session, limiter, max_retries=5, timeout=REQUEST_TIMEOUT):
+    ''' Route every HTTP request of a tidalapi session through the rate limiter,
+        waiting out and repeating requests Tidal throttles with a 429.
+        tidalapi sends its requests without a timeout, they get timeout seconds unless they set their own. '''
+    request_session = tidal_session.request_session
+    if getattr(request_session, '_rate_limiter', None) is limiter and getattr(request_session, '_request_timeout', None) == timeout:
+        return tidal_session
+    request = getattr(request_session, '_unlimited_request', request_session.request)
+
+    @functools.wraps(request)
+    def limited_request(*args, **kwargs):
+        # a connection that stops answering would otherwise hold its thread forever
+        kwargs.setdefault('timeout', timeout)
+        for attempt in range(max_retries + 1):
+            limiter.acquire()
+            retry_after = None
+            try:
+                response = request(*args, **kwargs)
+                if response.status_code == 429:
+                    retry_after = limiter.retry_after(response)
+            finally:
+                limiter.release(retry_after)
+            if retry_after is None or attempt == max_retries:
+                return response
+
+    request_session._unlimited_request = request
+    request_session._rate_limiter = limiter
+    request_session._request_timeout = timeout
+    request_session.request = limited_request
+    return tidal_session
+
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter(config):
+    global _rate_limiter
+    with _rate_limiter_lock:
+        if _rate_limiter is None:
+            # requests_per_second is only needed to stay under a limit below the one Tidal enforces
+            _rate_limiter = RateLimiter(rate=config.get('requests_per_second'),
+                                        burst=config.get('request_burst', 20),
+                                        max_concurrency=config.get('concurrency', config.get('subprocesses', 16)))
+        return _rate_limiter
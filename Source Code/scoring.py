@@ -0,0 +1,110 @@
+from itertools import chain
+import math
+
+# numpy is optional, without it candidates are scored one at a time in plain Python
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+TITLE_WEIGHT = 0.5
+ARTIST_WEIGHT = 0.3
+DURATION_WEIGHT = 0.2
+# a matching ISRC outweighs any difference in the metadata
+ISRC_BONUS = 1.0
+# added to the candidate the caller expects, e.g. the track at the same position of the album
+PREFER_BONUS = 0.05
+DURATION_TOLERANCE = 2
+# below this many candidates plain Python beats setting up and running the arrays
+NUMPY_MIN_CANDIDATES = 256
+
+def _jaccard(overlap, size_a, size_b):
+    union = size_a + size_b - overlap
+    return overlap/union if union else 0.0
+
+def _score_python(spotify_key, tidal_keys, eligible):
+    scores = []
+    for tidal_key in tidal_keys:
+        if not eligible(tidal_key, spotify_key):
+            scores.append(-math.inf)
+            continue
+        isrc = spotify_key.isrc is not None and tidal_key.isrc == spotify_key.isrc
+        delta = abs(tidal_key.duration - spotify_key.duration) if tidal_key.duration is not None else math.inf
+        title_overlap = len(spotify_key.full_title_tokens & tidal_key.full_title_tokens)
+        artist_overlap = len(spotify_key.artist_tokens & tidal_key.artist_tokens)
+        scores.append(ISRC_BONUS*isrc
+                      + TITLE_WEIGHT*_jaccard(title_overlap, len(spotify_key.full_title_tokens), len(tidal_key.full_title_tokens))
+                      + ARTIST_WEIGHT*_jaccard(artist_overlap, len(spotify_key.artist_tokens), len(tidal_key.artist_tokens))
+                      + DURATION_WEIGHT*max(0.0, 1 - delta/DURATION_TOLERANCE))
+    return scores
+
+class _TokenColumn:
+    ''' One token set per candidate, flattened into a single array '''
+    def __init__(self, token_sets):
+        self.sizes = numpy.fromiter(map(len, token_sets), dtype=numpy.int64, count=len(token_sets))
+        self.flat = numpy.fromiter(chain.from_iterable(token_sets), dtype=numpy.int64, count=int(self.sizes.sum()))
+        self.owners = numpy.repeat(numpy.arange(len(token_sets)), self.sizes)
+
+    def overlaps(self, tokens):
+        ''' How many of tokens every candidate's set contains '''
+        hits = numpy.isin(self.flat, numpy.fromiter(tokens, dtype=numpy.int64, count=len(tokens)))
+        return numpy.bincount(self.owners[hits], minlength=len(self.sizes))
+
+class CandidateBatch:
+    ''' The TrackKeys of the candidates one query returned. With numpy they are laid out in arrays once, so scoring
+        them against every Spotify track that runs into the same album or search result is a handful of array operations. '''
+    def __init__(self, tidal_keys):
+        self.keys = tidal_keys
+        self.vectorized = numpy is not None and len(tidal_keys) >= NUMPY_MIN_CANDIDATES
+        if self.vectorized:
+            self.durations = numpy.array([numpy.nan if key.duration is None else key.duration for key in tidal_keys], dtype=float)
+            self.isrcs = numpy.array([key.isrc for key in tidal_keys], dtype=object)
+            self.flags = numpy.fromiter((key.flags for key in tidal_keys), dtype=numpy.int64, count=len(tidal_keys))
+            self.full_titles = _TokenColumn([key.full_title_tokens for key in tidal_keys])
+            self.artists = _TokenColumn([key.artist_tokens for key in tidal_keys])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _scores_numpy(self, spotify_key, eligible):
+        isrc = self.isrcs == spotify_key.isrc if spotify_key.isrc is not None else numpy.zeros(len(self.keys), dtype=bool)
+        delta = numpy.abs(self.durations - spotify_key.duration)
+        # eligible only ever accepts these, so it is only asked about them
+        with numpy.errstate(invalid='ignore'):
+            maybe = isrc | ((delta < DURATION_TOLERANCE) & (self.flags == spotify_key.flags))
+        passed = numpy.zeros(len(self.keys), dtype=bool)
+        for index in numpy.flatnonzero(maybe):
+            passed[index] = eligible(self.keys[index], spotify_key)
+        title_overlap = self.full_titles.overlaps(spotify_key.full_title_tokens)
+        artist_overlap = self.artists.overlaps(spotify_key.artist_tokens)
+        title_union = len(spotify_key.full_title_tokens) + self.full_titles.sizes - title_overlap
+        artist_union = len(spotify_key.artist_tokens) + self.artists.sizes - artist_overlap
+        scores = (ISRC_BONUS*isrc
+                  + TITLE_WEIGHT*numpy.divide(title_overlap, title_union, out=numpy.zeros(len(self.keys)), where=title_union > 0)
+                  + ARTIST_WEIGHT*numpy.divide(artist_overlap, artist_union, out=numpy.zeros(len(self.keys)), where=artist_union > 0)
+                  + DURATION_WEIGHT*numpy.clip(1 - numpy.nan_to_num(delta, nan=math.inf)/DURATION_TOLERANCE, 0, 1))
+        return numpy.where(passed, scores, -math.inf)
+
+    def scores(self, spotify_key, eligible):
+        ''' Score every candidate against the Spotify track's TrackKey, -inf for those eligible(tidal_key, spotify_key)
+            rejects. eligible must also reject a candidate whose ISRC differs and whose duration or kind of version
+            doesn't match, as match() does. '''
+        if self.vectorized:
+            return self._scores_numpy(spotify_key, eligible)
+        return _score_python(spotify_key, self.keys, eligible)
+
+    def best_match(self, spotify_key, eligible, prefer=None):
+        ''' (index, score) of the best scoring eligible candidate, (None, -inf) if there is none.
+            The candidate at index prefer wins a close call. '''
+        if not self.keys:
+            return None, -math.inf
+        scores = self.scores(spotify_key, eligible)
+        if prefer is not None and 0 <= prefer < len(self.keys):
+            scores[prefer] += PREFER_BONUS
+        # the first of equal scores wins, so ties go to the candidate Tidal ranked highest
+        if self.vectorized:
+            best = int(numpy.argmax(scores))
+        else:
+            best = max(range(len(self.keys)), key=scores.__getitem__)
+        # every eligible candidate scores at least 0, the score only ranks them
+        return (best, float(scores[best])) if scores[best] > -math.inf else (None, -math.inf)
@@ -0,0 +1,59 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import threading
+
+class LRUCache:
+    ''' Thread safe LRU cache. Callers asking for a key that is still being loaded wait for that load instead of repeating it. '''
+    def __init__(self, maxsize=4096):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, load, *args, **kwargs):
+        with self._lock:
+            future = self._data.get(key)
+            loading = future is None
+            if loading:
+                self.misses += 1
+                future = self._data[key] = Future()
+                if len(self._data) > self.maxsize:
+                    self._data.popitem(last=False)
+            else:
+                self.hits += 1
+                self._data.move_to_end(key)
+        if loading:
+            try:
+                future.set_result(load(*args, **kwargs))
+            except BaseException as e:
+                # don't keep failures around, the next caller gets to try again
+                with self._lock:
+                    if self._data.get(key) is future:
+                        del self._data[key]
+                future.set_exception(e)
+        return future.result()
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+# shared by every search thread, tracks from the same album all look up the same album
+search_results = LRUCache()
+album_tracks = LRUCache()
+# the scoring arrays of a list of candidate tracks, by their ids
+candidate_batches = LRUCache()
+
+def cached_search(tidal_session, query, model):
+    return search_results.get_or_load((query, model.__name__), tidal_session.search, query, models=[model])
+
+def cached_album_tracks(album):
+    return album_tracks.get_or_load(album.id, album.tracks)
+
+def cached_candidate_batch(tidal_tracks, build):
+    return candidate_batches.get_or_load(tuple(track.id for track in tidal_tracks), build, tidal_tracks)
+
+def clear_search_cache():
+    search_results.clear()
+    album_tracks.clear()
+    candidate_batches.clear()
@@ -0,0 +1,114 @@
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+import functools
+import threading
+import time
+import requests
+from metrics import get_metrics
+from rate_limit import backoff_delay
+
+# tidalapi parses every response into one shared prototype object per type and then copies it,
+# so parsing has to be serialised once a session is used from several threads
+_PARSERS = ('parse_album', 'parse_artist', 'parse_artists', 'parse_playlist', 'parse_track',
+            'parse_video', 'parse_media', 'parse_mix', 'parse_user', 'parse_page')
+
+def _locked(function, lock):
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with lock:
+            return function(*args, **kwargs)
+    return wrapper
+
+def share_tidal_session(tidal_session, pool_size):
+    ''' Prepare a tidalapi session to be shared by pool_size threads over one keep-alive connection pool '''
+    if getattr(tidal_session, '_shared_pool_size', None) == pool_size:
+        return tidal_session
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+    tidal_session.request_session.mount('https://', adapter)
+    if not hasattr(tidal_session, '_shared_pool_size'):
+        lock = threading.RLock()
+        for name in _PARSERS:
+            if hasattr(tidal_session, name):
+                setattr(tidal_session, name, _locked(getattr(tidal_session, name), lock))
+        for relation in tidal_session.type_conversions:
+            relation.parse = _locked(relation.parse, lock)
+    tidal_session._shared_pool_size = pool_size
+    return tidal_session
+
+class SearchEngine:
+    ''' A bounded pool of threads that runs the I/O bound Tidal searches of every sync in this process '''
+    def __init__(self, concurrency):
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='tidal-search')
+        # searches submitted with a key, so playlists synced together search for a shared track only once
+        self._shared = {}
+        self._lock = threading.Lock()
+
+    def _attempt(self, future, function, value, kwargs, attempt, retries, deadline):
+        try:
+            call = self._executor.submit(function, value, **kwargs)
+        except RuntimeError as e:
+            # the engine was shut down while the call waited to be retried
+            future.set_exception(e)
+            return
+        def finished(call):
+            error = call.exception()
+            if error is None:
+                future.set_result(call.result())
+                return
+            delay = backoff_delay(attempt)
+            if not isinstance(error, requests.exceptions.RequestException) or attempt >= retries or time.monotonic() + delay > deadline:
+                future.set_exception(error)
+                return
+            print(f"{str(error)} occurred, retrying in {delay:.1f}s")
+            get_metrics().count('request_error_retries')
+            get_metrics().add_sleep(delay)
+            # wait on a timer rather than in the pool, so the other searches keep the thread
+            timer = threading.Timer(delay, self._attempt, (future, function, value, kwargs, attempt + 1, retries, deadline))
+            timer.daemon = True
+            timer.start()
+        call.add_done_callback(finished)
+
+    def _submit(self, function, value, retries, timeout, kwargs):
+        if not retries:
+            return self._executor.submit(function, value, **kwargs)
+        future = Future()
+        self._attempt(future, function, value, kwargs, 0, retries, time.monotonic() + (timeout or float('inf')))
+        return future
+
+    def submit(self, function, value, key=None, retries=0, timeout=None, **kwargs):
+        ''' Start function(value) on the pool and return its future, a key shares the call as described in imap_unordered.
+            Calls that fail with a request error are tried again up to retries times with a jittered exponential backoff,
+            as long as that stays within timeout seconds. '''
+        if key is None:
+            return self._submit(function, value, retries, timeout, kwargs)
+        with self._lock:
+            future = self._shared.get(key)
+            if future is None:
+                future = self._shared[key] = self._submit(function, value, retries, timeout, kwargs)
+            return future
+
+    def imap_unordered(self, function, values, keys=None, **kwargs):
+        ''' Call function on every value and yield (index, result) pairs as soon as each call finishes.
+            Values with the same key share a single call with every other search that used that key
+            until forget_shared() is called. '''
+        waiting = {}
+        for index, value in enumerate(values):
+            future = self.submit(function, value, key=keys[index] if keys else None, **kwargs)
+            waiting.setdefault(future, []).append(index)
+        for future in as_completed(waiting):
+            for index in waiting[future]:
+                yield index, future.result()
+
+    def forget_shared(self):
+        with self._lock:
+            self._shared.clear()
+
+_search_engine = None
+_search_engine_lock = threading.Lock()
+
+def get_search_engine(config):
+    global _search_engine
+    with _search_engine_lock:
+        if _search_engine is None:
+            _search_engine = SearchEngine(config.get('concurrency', config.get('subprocesses', 16)))
+        return _search_engine
@@ -0,0 +1,463 @@
+from auth import forget_tidal_session, get_tidal_session, open_spotify_session
+from collections import Counter, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
+import requests
+import sys
+import spotipy
+import tidalapi
+from tidalapi_patch import PlaylistSnapshot, get_tracks_by_isrc
+from sync_state import open_sync_state, NOT_FOUND
+from track_key import simple, spotify_track_key, tidal_track_key
+from scoring import CandidateBatch
+from search_cache import cached_album_tracks, cached_candidate_batch, cached_search, clear_search_cache
+from search_engine import get_search_engine, share_tidal_session
+from rate_limit import REQUEST_TIMEOUT, backoff_delay, get_rate_limiter, limit_tidal_session
+from metrics import get_metrics, instrument_session, start_metrics, write_metrics
+from config_store import get_config_store
+import math
+import threading
+import time
+import traceback
+
+def isrc_match(tidal_key, spotify_key):
+    return spotify_key.isrc is not None and tidal_key.isrc == spotify_key.isrc
+
+def duration_match(tidal_key, spotify_key, tolerance=2):
+    # the duration of the two tracks must be the same to within 2 seconds
+    return tidal_key.duration is not None and abs(tidal_key.duration - spotify_key.duration) < tolerance
+
+def name_match(tidal_key, spotify_key):
+    # handle some edge cases: instrumental, acapella and remix versions only match the same kind of version
+    if tidal_key.flags != spotify_key.flags: return False
+
+    # the simplified version of the Spotify track name must be a substring of the Tidal track name
+    # Try with both un-normalized and then normalized
+    return spotify_key.simple_title in tidal_key.title or spotify_key.normalized_simple_title in tidal_key.normalized_title
+
+def artist_match(tidal_key, spotify_key):
+    # There must be at least one overlapping artist between the Tidal and Spotify track
+    # Try with both un-normalized and then normalized
+    return not tidal_key.artists.isdisjoint(spotify_key.artists) or not tidal_key.normalized_artists.isdisjoint(spotify_key.normalized_artists)
+
+def match(tidal_key, spotify_key):
+    ''' compare the TrackKeys of a tidal track and a spotify track '''
+    return isrc_match(tidal_key, spotify_key) or (
+        duration_match(tidal_key, spotify_key)
+        and name_match(tidal_key, spotify_key)
+        and artist_match(tidal_key, spotify_key)
+    )
+
+
+# once an album has a match, how many more albums may still turn up a better one
+ALBUM_LOOKAHEAD = 2
+
+def candidate_batch(tidal_tracks):
+    return CandidateBatch([tidal_track_key(track) for track in tidal_tracks])
+
+def best_tidal_track(tidal_tracks, spotify_key):
+    ''' The best match for the spotify track among all the candidates a query returned, None if nothing matches '''
+    # every track of an album, or with the same search query, is scored against the same batch
+    best = cached_candidate_batch(tidal_tracks, candidate_batch).best_match(spotify_key, match)[0]
+    return tidal_tracks[best] if best is not None else None
+
+def tidal_search(spotify_track_and_cache, tidal_session):
+    spotify_track, cached_tidal_track = spotify_track_and_cache
+    if cached_tidal_track: return cached_tidal_track
+    spotify_key = spotify_track_key(spotify_track)
+    # an ISRC identifies the recording exactly, so try that before any fuzzy text search
+    if spotify_key.isrc:
+        track = best_tidal_track(get_tracks_by_isrc(tidal_session, spotify_key.isrc), spotify_key)
+        if track:
+            return track
+    # search for album name and first album artist
+    if 'album' in spotify_track and 'artists' in spotify_track['album'] and len(spotify_track['album']['artists']):
+        album_result = cached_search(tidal_session, simple(spotify_track['album']['name']) + " " + simple(spotify_track['album']['artists'][0]['name']), tidalapi.album.Album)
+        # albums are fetched one at a time in Tidal's order. A match at the track's own position settles it, any
+        # other match is only kept if none of the next ALBUM_LOOKAHEAD albums has a better one
+        position = spotify_track['track_number'] - 1
+        best_track, best_score, lookahead = None, -math.inf, ALBUM_LOOKAHEAD
+        for album in album_result['albums']:
+            if best_track is not None:
+                if not lookahead:
+                    break
+                lookahead -= 1
+            album_tracks = cached_album_tracks(album)
+            # score the whole album, on compilations and reissues the track number often differs
+            best, score = cached_candidate_batch(album_tracks, candidate_batch).best_match(spotify_key, match, prefer=position)
+            if best == position:
+                return album_tracks[best]
+            if score > best_score:
+                best_track, best_score = album_tracks[best], score
+        if best_track:
+            return best_track
+    # if that fails then search for track name and first artist
+    return best_tidal_track(cached_search(tidal_session, simple(spotify_track['name']) + ' ' + simple(spotify_track['artists'][0]['name']), tidalapi.media.Track)['tracks'], spotify_key)
+
+def get_tidal_playlists_dict(tidal_session):
+    # a dictionary of name --> playlist
+    tidal_playlists = tidal_session.user.playlists()
+    output = {}
+    for playlist in tidal_playlists:
+        output[playlist.name] = playlist
+    return output 
+
+def repeat_on_request_error(function, *args, remaining=5, timeout=None, **kwargs):
+    ''' Call the function, repeating it up to remaining times with a jittered exponential backoff if a request fails.
+        Gives up early rather than back off past timeout seconds, and raises the last error once it gives up. '''
+    deadline = time.monotonic() + (timeout or math.inf)
+    for attempt in range(remaining + 1):
+        try:
+            return function(*args, **kwargs)
+        except requests.exceptions.RequestException as e:
+            delay = backoff_delay(attempt)
+            if attempt == remaining or time.monotonic() + delay > deadline:
+                print(f"{str(e)} could not be recovered")
+                if not e.response is None:
+                    print(f"Response message: {e.response.text}")
+                    print(f"Response headers: {e.response.headers}")
+                raise
+            print(f"{str(e)} occurred, retrying in {delay:.1f}s")
+            get_metrics().count('request_error_retries')
+            get_metrics().add_sleep(delay)
+            time.sleep(delay)
+
+def iter_spotify_playlist_pages(spotify_session, spotify_playlist, prefetch=4, page_size=100):
+    ''' Yield the tracks of a spotify playlist a page at a time, in order, while the next few pages are already being fetched '''
+    fields = "total,items(track(name,album(name,artists),artists,track_number,duration_ms,id,external_ids(isrc)))"
+    def get_page(offset):
+        results = repeat_on_request_error(spotify_session.playlist_tracks, spotify_playlist["id"], fields=fields, limit=page_size, offset=offset)
+        return results, [r['track'] for r in results['items'] if r['track'] is not None]
+    results, tracks = get_page(0)
+    yield tracks
+    offsets = iter(range(page_size, results['total'], page_size))
+    with ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix='spotify-pages') as page_pool:
+        # only keep a window of pages in flight so memory stays bounded on huge playlists
+        pages = deque(page_pool.submit(get_page, offset) for offset in islice(offsets, prefetch))
+        while pages:
+            results, tracks = pages.popleft().result()
+            for offset in islice(offsets, 1):
+                pages.append(page_pool.submit(get_page, offset))
+            yield tracks
+
+class TidalPlaylistCache:
+    def __init__(self, snapshot):
+        self._data = snapshot.tracks
+        self._keys = [tidal_track_key(tidal_track) for tidal_track in self._data]
+        # index the playlist once by ISRC and by whole-second duration, so a lookup only has to run match()
+        # on the few tracks that could possibly pass isrc_match() or duration_match()
+        self._by_isrc = {}
+        self._by_duration = {}
+        for position, tidal_key in enumerate(self._keys):
+            if tidal_key.isrc:
+                self._by_isrc.setdefault(tidal_key.isrc, []).append(position)
+            if tidal_key.duration is not None:
+                self._by_duration.setdefault(int(tidal_key.duration), []).append(position)
+
+    def _candidates(self, spotify_key):
+        candidates = set()
+        if spotify_key.isrc is not None:
+            candidates.update(self._by_isrc.get(spotify_key.isrc, ()))
+        # every duration within the 2 second tolerance of duration_match()
+        for duration in range(math.floor(spotify_key.duration) - 1, math.ceil(spotify_key.duration) + 2):
+            candidates.update(self._by_duration.get(duration, ()))
+        # keep playlist order so the first matching track wins, as with a full scan
+        return sorted(candidates)
+
+    def _search(self, spotify_track):
+        ''' check if the given spotify track was already in the tidal playlist.'''
+        spotify_key = spotify_track_key(spotify_track)
+        for position in self._candidates(spotify_key):
+            if match(self._keys[position], spotify_key):
+                return self._data[position]
+        return None
+
+    def search(self, spotify_tracks):
+        ''' Pair each spotify track with the cached tidal track where applicable, or None '''
+        return [(track, self._search(track)) for track in spotify_tracks]
+
+def tidal_playlist_is_dirty(snapshot, new_track_ids):
+    return snapshot.differs_from(new_track_ids)
+
+def sync_playlist(spotify_session, tidal_session, spotify_id, tidal_id, config):
+    metrics = get_metrics()
+    try:
+        with metrics.phase('spotify_fetch', spotify_id):
+            spotify_playlist = spotify_session.playlist(spotify_id, fields="id,name,description,snapshot_id")
+    except spotipy.SpotifyException as e:
+        print("Error getting Spotify playlist " + spotify_id + "make sure the playlist is yours and the ID is correct")
+        #print(e)
+        #results.append(None)
+        return
+    
+    if tidal_id:
+        # if a Tidal playlist was specified then look it up
+        try:
+            tidal_playlist = tidal_session.playlist(tidal_id)
+        except Exception as e:
+            print("Error getting Tidal playlist " + tidal_id)
+            print(e)
+            return
+    else:
+        # create a new Tidal playlist if required
+        print(f"No playlist found on Tidal corresponding to Spotify playlist: '{spotify_playlist['name']}', creating new playlist")
+        tidal_playlist =  tidal_session.user.create_playlist(spotify_playlist['name'], spotify_playlist['description'])
+    sync_state = open_sync_state(config)
+    if tidal_id and sync_state.playlist_unchanged(spotify_playlist, tidal_playlist):
+        print("Spotify playlist '{}' has not changed since the last sync".format(spotify_playlist['name']))
+        metrics.count('playlists_unchanged')
+        return
+    # the playlist is downloaded once, the cache, the dirty check and the edits all work from this snapshot
+    with metrics.phase('tidal_fetch', spotify_id):
+        snapshot = PlaylistSnapshot.fetch(tidal_playlist, concurrency=config.get('tidal_page_concurrency', 8))
+    checkpoint = sync_state.get_checkpoint(spotify_playlist, tidal_playlist) if tidal_id else None
+    if checkpoint:
+        # an earlier run resolved every track and was interrupted while editing the playlist,
+        # the fresh snapshot tells what it got through so only the remaining edits are made
+        tidal_track_ids, batches = checkpoint
+        print("Resuming the interrupted sync of Spotify playlist '{}' after {} edit batches".format(spotify_playlist['name'], batches))
+        metrics.count('playlists_resumed')
+        write_tidal_playlist(sync_state, spotify_playlist, snapshot, tidal_track_ids)
+        return
+    # stream the spotify playlist through the cache and the resolution store, and start searching
+    # for the remaining tracks while later pages are still being fetched
+    engine = get_search_engine(config)
+    item_timeout = config.get('item_timeout', 120)
+    with metrics.phase('cache', spotify_id):
+        cache = TidalPlaylistCache(snapshot)
+    spotify_tracks = []
+    resolved = []
+    found = []
+    searches = {}
+    pages = iter_spotify_playlist_pages(spotify_session, spotify_playlist, config.get('spotify_prefetch', 4))
+    for page in metrics.timed(pages, 'spotify_fetch', spotify_id):
+        with metrics.phase('cache', spotify_id):
+            for spotify_track, cached_tidal_track in cache.search(page):
+                index = len(spotify_tracks)
+                spotify_tracks.append(spotify_track)
+                if cached_tidal_track:
+                    resolved.append(cached_tidal_track.id)
+                    found.append((spotify_track, cached_tidal_track.id))
+                    continue
+                # tracks resolved by a previous run don't need to be searched for again
+                resolved.append(sync_state.get_resolution(spotify_track))
+                if resolved[index] is None:
+                    # failed searches back off on a timer instead of holding on to a search thread
+                    future = engine.submit(tidal_search, (spotify_track, None), key=spotify_track['id'],
+                                           retries=config.get('retries', 5), timeout=item_timeout,
+                                           tidal_session=tidal_session)
+                    searches.setdefault(future, []).append(index)
+    metrics.count('tracks', len(spotify_tracks))
+    metrics.count('playlist_cache_hits', len(found))
+    metrics.count('resolution_store_hits', len(spotify_tracks) - len(found) - sum(map(len, searches.values())))
+    if len(found) == len(spotify_tracks):
+        print("No new tracks to search in Spotify playlist '{}'".format(spotify_playlist['name']))
+        sync_state.set_playlist_synced(spotify_playlist, tidal_playlist)
+        metrics.count('playlists_synced')
+        return
+    print ("Searching Tidal for {}/{} tracks in Spotify playlist '{}'".format(sum(map(len, searches.values())), len(spotify_tracks), spotify_playlist['name']))
+    metrics.count('tracks_searched', sum(map(len, searches.values())))
+    # remember what was found in the playlist or searched for this time, "not found" entries from earlier runs keep their age.
+    # Results are journaled as they come in, so a run that dies half way only searches for the rest next time.
+    checkpoint_every = config.get('checkpoint_every', 100)
+    journaled = 0
+    failed = []
+    try:
+        with metrics.phase('search', spotify_id):
+            pending = set(searches)
+            while pending:
+                # a search that hangs is given up once none has finished for item_timeout seconds, so it can't stall the playlist
+                done, pending = wait(pending, timeout=item_timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    for future in pending:
+                        for index in searches[future]:
+                            print("Searching for track {} timed out".format(spotify_tracks[index]['id']))
+                            failed.append((spotify_tracks[index]['id'], "no result within {}s".format(item_timeout)))
+                    break
+                for future in done:
+                    try:
+                        tidal_track = future.result()
+                    except Exception as e:
+                        # one track that can't be searched for doesn't hold up the playlist, it's retried on the next run
+                        for index in searches[future]:
+                            print("Searching for track {} failed: {}".format(spotify_tracks[index]['id'], e))
+                            failed.append((spotify_tracks[index]['id'], str(e)))
+                        continue
+                    for index in searches[future]:
+                        resolved[index] = tidal_track.id if tidal_track else NOT_FOUND
+                        found.append((spotify_tracks[index], tidal_track.id if tidal_track else None))
+                if len(found) - journaled >= checkpoint_every:
+                    sync_state.set_resolutions(found[journaled:])
+                    journaled = len(found)
+    finally:
+        with metrics.phase('state', spotify_id):
+            sync_state.set_resolutions(found[journaled:])
+    print ('Search done')
+    tidal_track_ids = []
+    for spotify_track, resolved_id in zip(spotify_tracks, resolved):
+        if resolved_id is None:
+            continue # the search failed
+        if resolved_id is not NOT_FOUND:
+            tidal_track_ids.append(resolved_id)
+        else:
+            print("Could not find track : {} - {}".format([a['name'] for a in spotify_track['artists']], spotify_track['name']))
+    metrics.count('tracks_failed', len(failed))
+    metrics.count('tracks_not_found', len(spotify_tracks) - len(tidal_track_ids) - len(failed))
+    write_tidal_playlist(sync_state, spotify_playlist, snapshot, tidal_track_ids, failed)
+
+def write_tidal_playlist(sync_state, spotify_playlist, snapshot, tidal_track_ids, failed=()):
+    metrics = get_metrics()
+    spotify_id = spotify_playlist['id']
+    with metrics.phase('dirty_check', spotify_id):
+        dirty = tidal_playlist_is_dirty(snapshot, tidal_track_ids)
+    if dirty:
+        # the edits take one request per batch, if they are interrupted the next run picks them up from the checkpoint.
+        # Without the failed tracks the target isn't worth resuming, that run searches for them again instead.
+        if not failed:
+            sync_state.set_checkpoint(spotify_playlist, snapshot.playlist, tidal_track_ids)
+        with metrics.phase('write', spotify_id):
+            snapshot.set_tracks(tidal_track_ids, on_batch=lambda: sync_state.checkpoint_batch(spotify_playlist))
+        metrics.count('playlists_written')
+    else:
+        print("No changes to write to Tidal playlist")
+    with metrics.phase('state', spotify_id):
+        if failed:
+            # not marked as synced, so the next run doesn't skip the playlist as unchanged and searches for them again
+            print("{} tracks of Spotify playlist '{}' will be retried on the next run".format(len(failed), spotify_playlist['name']))
+            sync_state.set_dead_letters(spotify_id, failed)
+        else:
+            sync_state.set_playlist_synced(spotify_playlist, snapshot.playlist)
+    metrics.count('playlists_synced')
+
+def sync_list(spotify_session, tidal_session, playlists, config, progress=None):
+  # playlists are synced side by side, their searches share the search engine and so its concurrency limit
+  done = []
+  done_lock = threading.Lock()
+  def sync_one(playlist):
+    spotify_id, tidal_id = playlist
+    # sync the spotify playlist to tidal, a playlist that fails is left for the next run instead of stopping the others
+    try:
+      repeat_on_request_error(sync_playlist, spotify_session, tidal_session, spotify_id, tidal_id, config)
+    except Exception as e:
+      print("Syncing Spotify playlist {} failed, it will be retried on the next run".format(spotify_id))
+      print(traceback.format_exc())
+      get_metrics().count('playlists_failed')
+      open_sync_state(config).set_dead_letters(spotify_id, [('', str(e))])
+    with done_lock:
+      done.append(spotify_id)
+      (progress or print_progress)(len(done), len(playlists), spotify_id)
+    return tidal_id
+  try:
+    with ThreadPoolExecutor(max_workers=config.get('playlist_concurrency', 4), thread_name_prefix='playlist-sync') as playlist_pool:
+      return list(playlist_pool.map(sync_one, playlists))
+  finally:
+    get_search_engine(config).forget_shared()
+    if not config.get('keep_search_cache', False):
+      clear_search_cache()
+
+def print_progress(done, total, spotify_id):
+    if total > 1:
+        print("[{}/{}] Synced Spotify playlist {}".format(done, total, spotify_id))
+
+def skip_duplicate_names(spotify_playlists):
+    ''' The playlists whose name no other playlist of the run shares. Tidal playlists are paired by name, so
+        playlists with the same name would edit the same Tidal playlist side by side, or each create a new one. '''
+    names = Counter(playlist['name'] for playlist in spotify_playlists)
+    for name, count in names.items():
+        if count > 1:
+            print("Skipping {} Spotify playlists all named \"{}\", rename them to sync them".format(count, name))
+            get_metrics().count('playlists_duplicate_name', count)
+    return [playlist for playlist in spotify_playlists if names[playlist['name']] == 1]
+
+def pick_tidal_playlist_for_spotify_playlist(spotify_playlist, tidal_playlists):
+    if spotify_playlist['name'] in tidal_playlists:
+      # if there's an existing tidal playlist with the name of the current playlist then use that
+      tidal_playlist = tidal_playlists[spotify_playlist['name']]
+      return (spotify_playlist['id'], tidal_playlist.id)
+    else:
+      return (spotify_playlist['id'], None)
+
+def get_spotify_user_playlists(spotify_session, page_size=50, prefetch=4):
+    ''' Every playlist in the user's Spotify library. The first page says how many there are, the rest are fetched side by side. '''
+    def get_page(offset):
+        return repeat_on_request_error(spotify_session.current_user_playlists, limit=page_size, offset=offset)
+    first_page = get_page(0)
+    pages = [first_page]
+    offsets = range(page_size, first_page['total'], page_size)
+    if offsets:
+        with ThreadPoolExecutor(max_workers=prefetch, thread_name_prefix='spotify-pages') as page_pool:
+            pages.extend(page_pool.map(get_page, offsets))
+    return [playlist for page in pages for playlist in page['items'] if playlist]
+
+def open_sessions(config):
+    ''' Log in to both services and prepare the Tidal session to be shared by every sync thread.
+        The Tidal session is the process wide one, so later syncs of the process reuse its login and connections. '''
+    spotify_session = open_spotify_session(config['spotify'])
+    tidal_session = get_tidal_session()
+    if not tidal_session.check_login():
+        forget_tidal_session(tidal_session)
+        sys.exit("Could not connect to Tidal")
+    # one keep-alive connection per search thread
+    share_tidal_session(tidal_session, get_search_engine(config).concurrency)
+    limit_tidal_session(tidal_session, get_rate_limiter(config), timeout=config.get('request_timeout', REQUEST_TIMEOUT))
+    instrument_session(tidal_session.request_session)
+    if hasattr(spotify_session, '_session'):
+        instrument_session(spotify_session._session)
+    return spotify_session, tidal_session
+
+def load_config():
+    return get_config_store().load()
+
+def report_metrics(metrics, config):
+    summary = write_metrics(metrics, config)
+    print("Sync took {}s, {} requests".format(summary['duration_seconds'], sum(r['count'] for r in summary['requests'].values())))
+
+def sync_many(ids, progress=None):
+    ''' Sync several Spotify playlists in one go, opening the sessions once and searching for tracks they share only once '''
+    # the same playlist listed twice is synced once
+    ids = list(dict.fromkeys(id for id in ids if id))
+    if not ids:
+        print ("Missing ID!")
+        return
+    config = load_config()
+    metrics = start_metrics()
+    try:
+        spotify_session, tidal_session = open_sessions(config)
+        tidal_playlists = get_tidal_playlists_dict(tidal_session)
+        spotify_playlists = []
+        for url in ids:
+            try:
+                spotify_playlists.append(spotify_session.playlist(url, fields="id,name"))
+            except spotipy.SpotifyException as e:
+                print("Error getting Spotify playlist \"" + url + "\"\nMake sure the playlist ID is correct.")
+                print(e)
+        playlists = [pick_tidal_playlist_for_spotify_playlist(playlist, tidal_playlists) for playlist in skip_duplicate_names(spotify_playlists)]
+        sync_list(spotify_session, tidal_session, playlists, config, progress)
+    finally:
+        # also when the run was aborted, that is when the numbers are most interesting
+        report_metrics(metrics, config)
+
+def sync_library(owned_only=False, progress=None):
+    ''' Sync every playlist in the user's Spotify library, or only those they own, in one run '''
+    config = load_config()
+    metrics = start_metrics()
+    try:
+        spotify_session, tidal_session = open_sessions(config)
+        spotify_playlists = get_spotify_user_playlists(spotify_session, prefetch=config.get('spotify_prefetch', 4))
+        if owned_only:
+            user_id = spotify_session.current_user()['id']
+            spotify_playlists = [playlist for playlist in spotify_playlists if playlist['owner']['id'] == user_id]
+        print("Found {} playlists in the Spotify library".format(len(spotify_playlists)))
+        metrics.count('library_playlists', len(spotify_playlists))
+        # one listing of the Tidal playlists serves every playlist of the run
+        tidal_playlists = get_tidal_playlists_dict(tidal_session)
+        playlists = [pick_tidal_playlist_for_spotify_playlist(playlist, tidal_playlists) for playlist in skip_duplicate_names(spotify_playlists)]
+        sync_list(spotify_session, tidal_session, playlists, config, progress)
+    finally:
+        report_metrics(metrics, config)
+
+def sync(url):
+    if url=='':
+        print ("Missing ID!")
+    else:
+        sync_many([url])
@@ -0,0 +1,179 @@
+from config_store import CONFIG_FILE, get_config_store
+from sync_state import open_sync_state
+import datetime
+import heapq
+import os
+import threading
+import time
+import traceback
+
+# the format last_up was kept in by schedules written to config.yml before it moved to the sync state
+LAST_UP_FORMAT = '%d/%m/%Y %H:%M:%S'
+SYNC_INTERVALS = {
+    'HOURLY': datetime.timedelta(hours=1),
+    'DAILY': datetime.timedelta(days=1),
+    'WEEKLY': datetime.timedelta(weeks=1),
+    'MONTHLY': datetime.timedelta(days=30),
+}
+# a run started by the task scheduler a little before a playlist is due still syncs it
+DUE_TOLERANCE = datetime.timedelta(minutes=5)
+
+def load_config(path=CONFIG_FILE):
+    return get_config_store(path).load()
+
+def last_synced(id_value, id_data, state):
+    timestamp = state.get_last_synced(id_value)
+    if timestamp is not None:
+        return datetime.datetime.fromtimestamp(timestamp)
+    if id_data.get('last_up'):
+        return datetime.datetime.strptime(id_data['last_up'], LAST_UP_FORMAT)
+    return None
+
+def next_sync_time(id_value, id_data, state):
+    last_up_time = last_synced(id_value, id_data, state)
+    if last_up_time is None:
+        # never synced on schedule, so it's due right away
+        return datetime.datetime.now()
+    return last_up_time + SYNC_INTERVALS[id_data['type']]
+
+def reached_due_time(id_value, id_data, state, current_time):
+    ''' The latest time the playlist was due at by current_time, give or take DUE_TOLERANCE, or None if it isn't due.
+        That, rather than the time a sync started, is what the sync counts as, so the schedule doesn't drift
+        by the few seconds every start takes and a run that starts a little early doesn't skip the playlist. '''
+    last_up_time = last_synced(id_value, id_data, state)
+    if last_up_time is None:
+        return current_time
+    interval = SYNC_INTERVALS[id_data['type']]
+    due = last_up_time + interval
+    if due > current_time + DUE_TOLERANCE:
+        return None
+    # the due times missed while nothing ran are caught up with in one sync
+    return due + (current_time + DUE_TOLERANCE - due)//interval*interval
+
+def due_playlists(current_time, path=CONFIG_FILE):
+    ''' The scheduled playlists that are due, with the due time each of them reached '''
+    config = load_config(path)
+    state = open_sync_state(config)
+    return {id_value: due for id_value, due in ((id_value, reached_due_time(id_value, id_data, state, current_time))
+                                               for id_value, id_data in (config.get('schedule') or {}).items()) if due}
+
+def check_sync_needed(current_time=None):
+    # Dictionary to store IDs that need syncing
+    return {id_value: id_value for id_value in due_playlists(current_time or datetime.datetime.now())}
+
+def mark_synced(ids, sync_time, path=CONFIG_FILE):
+    ''' Remember the time a sync of the scheduled playlists started. It goes to the sync state rather than
+        config.yml, which only holds what the user set up and is left alone by the syncs. '''
+    open_sync_state(load_config(path)).set_last_synced(ids, sync_time.timestamp())
+
+def mark_due_synced(ids, current_time, path=CONFIG_FILE):
+    ''' Remember the playlists of a scheduled sync as synced at the due time they reached '''
+    due = due_playlists(current_time, path)
+    for id_value in ids:
+        mark_synced([id_value], due.get(id_value, current_time), path)
+
+def dead_letter_ids(ids, path=CONFIG_FILE):
+    ''' Playlists an earlier run couldn't finish, that aren't in ids already. They go along with the next scheduled sync. '''
+    config = load_config(path)
+    failed = open_sync_state(config).dead_letter_playlists(config.get('dead_letter_attempts', 5))
+    return [id_value for id_value in failed if id_value not in ids]
+
+def sync_due(sync=None, current_time=None):
+    ''' Sync every scheduled playlist that is due in one batch and remember when it was synced '''
+    if sync is None:
+        from sync_engine import sync_many as sync
+    current_time = current_time or datetime.datetime.now()
+    ids = list(check_sync_needed(current_time))
+    if not ids:
+        print("No scheduled playlist is due")
+        return []
+    retry = dead_letter_ids(ids)
+    if retry:
+        print("Retrying {} playlist(s) that failed last time".format(len(retry)))
+    sync(ids + retry)
+    # the retried playlists keep their own schedule
+    mark_due_synced(ids, current_time)
+    return ids
+
+class Scheduler:
+    ''' Resident scheduler: keeps the scheduled playlists in a heap ordered by when they are next due and
+        sleeps until the first of them is. Playlists due within coalesce seconds of each other are synced
+        together in one sync_many() call, so they share the sessions and the searches. '''
+    def __init__(self, sync=None, path=CONFIG_FILE, coalesce=60, rescan=60, retry=600):
+        if sync is None:
+            from sync_engine import sync_many as sync
+        self.sync = sync
+        self.path = path
+        self.coalesce = coalesce
+        # how often config.yml is checked for playlists scheduled from the GUI
+        self.rescan = rescan
+        # how long a playlist whose sync failed waits before it is tried again
+        self.retry = retry
+        self._queue = []
+        self._retry_at = {}
+        self._mtime = None
+        self._stop = threading.Event()
+
+    def _reload(self):
+        ''' Rebuild the heap whenever config.yml changed '''
+        mtime = os.stat(self.path).st_mtime_ns
+        if mtime == self._mtime:
+            return
+        config = load_config(self.path)
+        state = open_sync_state(config)
+        queue = []
+        for id_value, id_data in (config.get('schedule') or {}).items():
+            if id_data.get('type') not in SYNC_INTERVALS:
+                print("Unknown schedule type {} for playlist {}".format(id_data.get('type'), id_value))
+                continue
+            due = max(next_sync_time(id_value, id_data, state).timestamp(), self._retry_at.get(id_value, 0))
+            queue.append((due, id_value))
+        heapq.heapify(queue)
+        self._queue = queue
+        self._mtime = mtime
+
+    def _pop_due(self, now):
+        batch = []
+        while self._queue and self._queue[0][0] <= now + self.coalesce:
+            batch.append(heapq.heappop(self._queue)[1])
+        return batch
+
+    def run_once(self):
+        ''' Sync whatever is due and return the number of seconds until the next playlist is '''
+        try:
+            self._reload()
+        except Exception:
+            # a missing or half edited config.yml keeps the schedule read before, it is read again after rescan seconds
+            print(traceback.format_exc())
+            return self.rescan
+        now = time.time()
+        if not self._queue or self._queue[0][0] > now:
+            return min(self._queue[0][0] - now, self.rescan) if self._queue else self.rescan
+        batch = self._pop_due(now)
+        started = datetime.datetime.now()
+        retry = dead_letter_ids(batch, self.path)
+        print("Syncing {} scheduled playlist(s)".format(len(batch)))
+        if retry:
+            print("Retrying {} playlist(s) that failed last time".format(len(retry)))
+        try:
+            self.sync(batch + retry)
+        except (Exception, SystemExit):
+            # the daemon outlives a failed sync, the playlists are tried again later
+            print(traceback.format_exc())
+            for id_value in batch:
+                self._retry_at[id_value] = now + self.retry
+                heapq.heappush(self._queue, (now + self.retry, id_value))
+            return 0
+        for id_value in batch:
+            self._retry_at.pop(id_value, None)
+        # the batch is rescheduled from the last_up persisted here
+        mark_due_synced(batch, started, self.path)
+        self._mtime = None
+        return 0
+
+    def run(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.run_once())
+
+    def stop(self):
+        self._stop.set()
@@ -0,0 +1,164 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+
+STATE_FILE = '.sync_state.db'
+
+# marker returned by SyncState.get_resolution for tracks that were searched recently and not found
+NOT_FOUND = object()
+
+class SyncState:
+    ''' Small SQLite store that keeps what previous syncs learned, next to config.yml '''
+    def __init__(self, path=STATE_FILE, not_found_ttl=7*24*60*60):
+        self.not_found_ttl = not_found_ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('''CREATE TABLE IF NOT EXISTS resolutions (
+                                    spotify_id TEXT PRIMARY KEY,
+                                    isrc TEXT,
+                                    tidal_id INTEGER,
+                                    resolved_at REAL NOT NULL)''')
+            self._db.execute('CREATE INDEX IF NOT EXISTS resolutions_isrc ON resolutions (isrc)')
+            self._db.execute('''CREATE TABLE IF NOT EXISTS playlists (
+                                    spotify_id TEXT PRIMARY KEY,
+                                    snapshot_id TEXT,
+                                    tidal_id TEXT,
+                                    tidal_etag TEXT,
+                                    synced_at REAL NOT NULL)''')
+            # syncs that were interrupted after their searches finished, see set_checkpoint
+            self._db.execute('''CREATE TABLE IF NOT EXISTS checkpoints (
+                                    spotify_id TEXT PRIMARY KEY,
+                                    snapshot_id TEXT,
+                                    tidal_id TEXT,
+                                    track_ids TEXT NOT NULL,
+                                    batches INTEGER NOT NULL,
+                                    updated_at REAL NOT NULL)''')
+            # tracks, or with an empty track_id whole playlists, whose sync kept failing, see set_dead_letters
+            self._db.execute('''CREATE TABLE IF NOT EXISTS dead_letters (
+                                    playlist_id TEXT NOT NULL,
+                                    track_id TEXT NOT NULL,
+                                    error TEXT,
+                                    attempts INTEGER NOT NULL,
+                                    failed_at REAL NOT NULL,
+                                    PRIMARY KEY (playlist_id, track_id))''')
+            # when each scheduled playlist was last synced, config.yml only says how often it should be
+            self._db.execute('''CREATE TABLE IF NOT EXISTS schedule (
+                                    playlist_id TEXT PRIMARY KEY,
+                                    last_up REAL NOT NULL)''')
+
+    def get_resolution(self, spotify_track):
+        ''' Return the Tidal track id a previous run resolved the spotify track to, NOT_FOUND if it was
+            searched for recently without success, or None if it has to be searched for '''
+        isrc = spotify_track.get('external_ids', {}).get('isrc')
+        with self._lock:
+            row = None
+            if spotify_track.get('id'):
+                row = self._db.execute('SELECT tidal_id, resolved_at FROM resolutions WHERE spotify_id = ?',
+                                       (spotify_track['id'],)).fetchone()
+            if (row is None or row[0] is None) and isrc:
+                # the same recording may have been resolved through another Spotify release
+                isrc_row = self._db.execute('SELECT tidal_id, resolved_at FROM resolutions WHERE isrc = ? AND tidal_id IS NOT NULL',
+                                            (isrc,)).fetchone()
+                row = isrc_row or row
+        if row is None:
+            return None
+        tidal_id, resolved_at = row
+        if tidal_id is not None:
+            return tidal_id
+        if time.time() - resolved_at < self.not_found_ttl:
+            return NOT_FOUND
+        return None
+
+    def set_resolutions(self, resolutions):
+        ''' Record (spotify_track, tidal_id) pairs, a tidal_id of None records the track as not found '''
+        now = time.time()
+        rows = [(spotify_track['id'], spotify_track.get('external_ids', {}).get('isrc'), tidal_id, now)
+                for spotify_track, tidal_id in resolutions if spotify_track.get('id')]
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO resolutions (spotify_id, isrc, tidal_id, resolved_at) VALUES (?, ?, ?, ?)', rows)
+
+    def playlist_unchanged(self, spotify_playlist, tidal_playlist):
+        ''' True if neither playlist changed since they were last synced with each other.
+            Syncs older than the "not found" TTL never count, so missing tracks get searched for again. '''
+        with self._lock:
+            row = self._db.execute('SELECT snapshot_id, tidal_id, tidal_etag, synced_at FROM playlists WHERE spotify_id = ?',
+                                   (spotify_playlist['id'],)).fetchone()
+        if row is None:
+            return False
+        snapshot_id, tidal_id, tidal_etag, synced_at = row
+        return (snapshot_id == spotify_playlist.get('snapshot_id') and tidal_id == tidal_playlist.id
+                and tidal_etag == tidal_playlist._etag and time.time() - synced_at < self.not_found_ttl)
+
+    def set_playlist_synced(self, spotify_playlist, tidal_playlist):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO playlists (spotify_id, snapshot_id, tidal_id, tidal_etag, synced_at) VALUES (?, ?, ?, ?, ?)',
+                             (spotify_playlist['id'], spotify_playlist.get('snapshot_id'), tidal_playlist.id, tidal_playlist._etag, time.time()))
+            # the sync finished, there is nothing left to resume or to retry
+            self._db.execute('DELETE FROM checkpoints WHERE spotify_id = ?', (spotify_playlist['id'],))
+            self._db.execute('DELETE FROM dead_letters WHERE playlist_id = ?', (spotify_playlist['id'],))
+
+    def get_checkpoint(self, spotify_playlist, tidal_playlist):
+        ''' The Tidal track ids an interrupted sync between the same two playlists was writing and how many edit
+            batches it got through, or None if there is nothing to resume or the Spotify playlist changed since '''
+        with self._lock:
+            row = self._db.execute('SELECT snapshot_id, tidal_id, track_ids, batches FROM checkpoints WHERE spotify_id = ?',
+                                   (spotify_playlist['id'],)).fetchone()
+        if row is None:
+            return None
+        snapshot_id, tidal_id, track_ids, batches = row
+        if snapshot_id != spotify_playlist.get('snapshot_id') or tidal_id != tidal_playlist.id:
+            return None
+        return json.loads(track_ids), batches
+
+    def set_checkpoint(self, spotify_playlist, tidal_playlist, track_ids):
+        ''' Record the Tidal track ids the playlist is about to be edited into, once every track has been resolved '''
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO checkpoints (spotify_id, snapshot_id, tidal_id, track_ids, batches, updated_at) VALUES (?, ?, ?, ?, 0, ?)',
+                             (spotify_playlist['id'], spotify_playlist.get('snapshot_id'), tidal_playlist.id, json.dumps(track_ids), time.time()))
+
+    def checkpoint_batch(self, spotify_playlist):
+        ''' Record that one more edit batch reached Tidal '''
+        with self._lock, self._db:
+            self._db.execute('UPDATE checkpoints SET batches = batches + 1, updated_at = ? WHERE spotify_id = ?',
+                             (time.time(), spotify_playlist['id']))
+
+    def set_dead_letters(self, playlist_id, failures):
+        ''' Replace the dead letters of a playlist with (track_id, error) pairs, a track_id of '' standing for the
+            whole playlist. Each entry counts the runs in a row it has failed in. '''
+        now = time.time()
+        with self._lock, self._db:
+            attempts = dict(self._db.execute('SELECT track_id, attempts FROM dead_letters WHERE playlist_id = ?', (playlist_id,)))
+            self._db.execute('DELETE FROM dead_letters WHERE playlist_id = ?', (playlist_id,))
+            self._db.executemany('INSERT OR REPLACE INTO dead_letters (playlist_id, track_id, error, attempts, failed_at) VALUES (?, ?, ?, ?, ?)',
+                                 [(playlist_id, track_id, error, attempts.get(track_id, 0) + 1, now) for track_id, error in failures])
+
+    def dead_letter_playlists(self, max_attempts=5):
+        ''' The playlists with dead letters that have not failed max_attempts runs in a row yet '''
+        with self._lock:
+            rows = self._db.execute('SELECT DISTINCT playlist_id FROM dead_letters WHERE attempts < ? ORDER BY failed_at',
+                                    (max_attempts,)).fetchall()
+        return [playlist_id for playlist_id, in rows]
+
+    def get_last_synced(self, playlist_id):
+        ''' The time a scheduled sync of the playlist last started, None if it hasn't been synced on schedule yet '''
+        with self._lock:
+            row = self._db.execute('SELECT last_up FROM schedule WHERE playlist_id = ?', (playlist_id,)).fetchone()
+        return row[0] if row else None
+
+    def set_last_synced(self, playlist_ids, timestamp):
+        with self._lock, self._db:
+            self._db.executemany('INSERT OR REPLACE INTO schedule (playlist_id, last_up) VALUES (?, ?)',
+                                 [(playlist_id, timestamp) for playlist_id in playlist_ids])
+
+_sync_states = {}
+_sync_states_lock = threading.Lock()
+
+def open_sync_state(config):
+    path = os.path.abspath(config.get('state_file', STATE_FILE))
+    with _sync_states_lock:
+        if path not in _sync_states:
+            _sync_states[path] = SyncState(path, not_found_ttl=config.get('not_found_ttl_days', 7)*24*60*60)
+        return _sync_states[path]
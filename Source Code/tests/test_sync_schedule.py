@@ -0,0 +1,48 @@
+import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sync_schedule
+
+def test_hourly_runs_started_a_little_late_never_skip(tmp_path, monkeypatch):
+    ''' The task scheduler starts every run a few seconds after the hour, every run has to sync the playlist '''
+    monkeypatch.chdir(tmp_path)
+    state_file = str(tmp_path / 'state.db')
+    (tmp_path / 'config.yml').write_text("state_file: {}\nschedule:\n  playlist:\n    type: HOURLY\n".format(state_file))
+    start = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    sync_schedule.mark_synced(['playlist'], start)
+    synced = []
+    for hour, delay in enumerate((5, 3, 6, 2), start=1):
+        run_time = start + datetime.timedelta(hours=hour, seconds=delay)
+        synced.append(sync_schedule.sync_due(lambda ids: None, run_time) == ['playlist'])
+    assert synced == [True, True, True, True]
+
+def test_runs_in_between_due_times_skip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    state_file = str(tmp_path / 'state.db')
+    (tmp_path / 'config.yml').write_text("state_file: {}\nschedule:\n  playlist:\n    type: HOURLY\n".format(state_file))
+    start = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    sync_schedule.mark_synced(['playlist'], start)
+    assert sync_schedule.sync_due(lambda ids: None, start + datetime.timedelta(minutes=30)) == []
+    # three missed hours are caught up with in one sync, the next one is due on the hour again
+    assert sync_schedule.sync_due(lambda ids: None, start + datetime.timedelta(hours=3, minutes=20)) == ['playlist']
+    assert sync_schedule.sync_due(lambda ids: None, start + datetime.timedelta(hours=3, minutes=50)) == []
+    assert sync_schedule.sync_due(lambda ids: None, start + datetime.timedelta(hours=4, seconds=1)) == ['playlist']
+
+def test_scheduler_outlives_a_broken_config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config = tmp_path / 'config.yml'
+    config.write_text("state_file: {}\nschedule:\n  playlist:\n    type: HOURLY\n".format(tmp_path / 'state.db'))
+    scheduler = sync_schedule.Scheduler(sync=lambda ids: None, rescan=30)
+    scheduler.run_once()
+    queue = list(scheduler._queue)
+    config.write_text("schedule: [unclosed\n")
+    # a later mtime than the config read before, even on file systems with coarse timestamps
+    os.utime(config, ns=(0, config.stat().st_mtime_ns + 10**9))
+    assert scheduler.run_once() == 30
+    assert scheduler._queue == queue
+    config.unlink()
+    assert scheduler.run_once() == 30
+    assert scheduler._queue == queue
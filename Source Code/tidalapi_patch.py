@@ -1,25 +1,135 @@
+from concurrent.futures import ThreadPoolExecutor
+from difflib import SequenceMatcher
+import requests
 
-def _remove_indices_from_playlist(playlist, indices):
+def _update_etag(playlist, response):
+    # every edit answers with the playlist's new ETag, which saves refetching the playlist before the next edit
+    etag = response.headers.get('etag')
+    if etag:
+        playlist._etag = etag
+    else:
+        playlist._reparse()
+
+def _delete_playlist_indices(playlist, indices):
     headers = {'If-None-Match': playlist._etag}
     index_string = ",".join(map(str, indices))
-    playlist.requests.request('DELETE', (playlist._base_url + '/items/%s') % (playlist.id, index_string), headers=headers)
-    playlist._reparse()
-
-def clear_tidal_playlist(playlist, chunk_size=20):
-    while playlist.num_tracks:
-        indices = range(min(playlist.num_tracks, chunk_size))
-        _remove_indices_from_playlist(playlist, indices)
-
-def add_multiple_tracks_to_playlist(playlist, track_ids, chunk_size=20):
-    offset = 0
-    while offset < len(track_ids):
-        count = min(chunk_size, len(track_ids) - offset)
-        playlist.add(track_ids[offset:offset+chunk_size])
-        offset += count
-    
-
-def set_tidal_playlist(playlist, track_ids):
-    print("Erasing existing tracks from Tidal playlist...")
-    clear_tidal_playlist(playlist)
-    print("Adding new tracks to Tidal playlist...")
-    add_multiple_tracks_to_playlist(playlist, track_ids)
+    response = playlist.requests.request('DELETE', (playlist._base_url + '/items/%s') % (playlist.id, index_string), headers=headers)
+    _update_etag(playlist, response)
+
+def _insert_tracks_into_playlist(playlist, track_ids, index):
+    headers = {'If-None-Match': playlist._etag}
+    data = {
+        'onArtifactNotFound': 'SKIP',
+        'onDupes': 'ADD',
+        'trackIds': ",".join(map(str, track_ids)),
+        'toIndex': index,
+    }
+    response = playlist.requests.request('POST', (playlist._base_url + '/items') % playlist.id, data=data, headers=headers)
+    _update_etag(playlist, response)
+
+def playlist_edit_script(old_track_ids, new_track_ids):
+    ''' Work out the smallest set of edits that turns old_track_ids into new_track_ids.
+        Returns the indices of old_track_ids to delete and, for after the deletions,
+        a list of (index, track_ids) runs to insert in ascending order of index. '''
+    deletes = []
+    inserts = []
+    matcher = SequenceMatcher(None, old_track_ids, new_track_ids, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag in ('delete', 'replace'):
+            deletes.extend(range(i1, i2))
+        if tag in ('insert', 'replace'):
+            inserts.append((j1, new_track_ids[j1:j2]))
+    return deletes, inserts
+
+class PlaylistSnapshot:
+    ''' The tracks of a Tidal playlist, fetched once and then kept in step with the edits made through set_tracks(),
+        so nothing has to fetch the playlist again to compare against it or to work out an edit '''
+    def __init__(self, playlist, track_ids, tracks=()):
+        self.playlist = playlist
+        self.track_ids = list(track_ids)
+        self._tracks = {track.id: track for track in tracks}
+
+    @classmethod
+    def fetch(cls, playlist, page_size=None, concurrency=8):
+        ''' Fetch the pages of the playlist at the same time, asking for as many tracks per page as the session's
+            item_limit by default. The responses also give us the ETag the edits need. '''
+        page_size = page_size or playlist.session.config.item_limit
+        # a session that isn't shared between threads can't parse responses on several of them
+        concurrency = min(concurrency, getattr(playlist.session, '_shared_pool_size', 1))
+        def get_page(offset):
+            return playlist.tracks(limit=page_size, offset=offset)
+        tracks = get_page(0)
+        # Tidal may cap pages below the limit we asked for, the first page tells how many it really returns
+        step = len(tracks)
+        offsets = range(step, playlist.num_tracks, step) if step else ()
+        if concurrency > 1 and len(offsets) > 1:
+            with ThreadPoolExecutor(max_workers=min(concurrency, len(offsets)), thread_name_prefix='tidal-pages') as page_pool:
+                pages = list(page_pool.map(get_page, offsets))
+        else:
+            pages = [get_page(offset) for offset in offsets]
+        tracks.extend(track for page in pages for track in page)
+        if len(tracks) != playlist.num_tracks:
+            # edits computed from a playlist with gaps would delete the wrong tracks, so when the pages don't add
+            # up (the playlist changed, or a page came back short) read it again one page after the other to the end
+            tracks = []
+            while True:
+                page = get_page(len(tracks))
+                if not page:
+                    break
+                tracks.extend(page)
+        return cls(playlist, [track.id for track in tracks], tracks)
+
+    @property
+    def tracks(self):
+        ''' The fetched tidalapi Tracks in playlist order, None for tracks added since that are only known by id '''
+        return [self._tracks.get(track_id) for track_id in self.track_ids]
+
+    def differs_from(self, track_ids):
+        return self.track_ids != list(track_ids)
+
+    def _delete(self, indices):
+        _delete_playlist_indices(self.playlist, indices)
+        for index in sorted(indices, reverse=True):
+            del self.track_ids[index]
+
+    def _insert(self, track_ids, index):
+        _insert_tracks_into_playlist(self.playlist, track_ids, index)
+        self.track_ids[index:index] = track_ids
+
+    def set_tracks(self, track_ids, chunk_size=100, on_batch=None):
+        ''' Edit the playlist into track_ids with as few requests as possible, calling on_batch() after every request '''
+        on_batch = on_batch or (lambda: None)
+        deletes, inserts = playlist_edit_script(self.track_ids, track_ids)
+        if deletes:
+            print("Removing {} tracks from Tidal playlist...".format(len(deletes)))
+            # delete from the end of the playlist so the indices of the remaining deletions stay valid
+            deletes.reverse()
+            for offset in range(0, len(deletes), chunk_size):
+                self._delete(deletes[offset:offset+chunk_size])
+                on_batch()
+        if inserts:
+            print("Adding {} tracks to Tidal playlist...".format(sum(len(run) for _, run in inserts)))
+            # everything in front of an insertion point already matches the target by the time we get there
+            for index, run in inserts:
+                for offset in range(0, len(run), chunk_size):
+                    self._insert(run[offset:offset+chunk_size], index + offset)
+                    on_batch()
+
+def set_tidal_playlist(playlist, track_ids, old_track_ids=None, chunk_size=100):
+    snapshot = PlaylistSnapshot.fetch(playlist) if old_track_ids is None else PlaylistSnapshot(playlist, old_track_ids)
+    snapshot.set_tracks(track_ids, chunk_size)
+    return snapshot
+
+def get_tracks_by_isrc(session, isrc):
+    ''' Look a recording up directly by its ISRC, returns an empty list if Tidal doesn't know it.
+        The endpoint only takes one ISRC per request. '''
+    try:
+        response = session.request.request('GET', 'tracks', params={'isrc': isrc.upper()})
+    except requests.exceptions.HTTPError as e:
+        if e.response is not None and e.response.status_code in (400, 404):
+            return []
+        raise
+    json_obj = response.json()
+    if 'items' not in json_obj:
+        return [session.parse_track(json_obj)]
+    return session.request.map_json(json_obj, parse=session.parse_track)
@@ -0,0 +1,73 @@
+import re
+import unicodedata
+
+def normalize(s):
+    return unicodedata.normalize('NFD', s).encode('ascii', 'ignore').decode('ascii')
+
+def simple(input_string):
+    # only take the first part of a string before any hyphens or brackets to account for different versions
+    return input_string.split('-')[0].strip().split('(')[0].strip().split('[')[0].strip()
+
+def split_artist_name(artist):
+    if '&' in artist:
+        return artist.split('&')
+    elif ',' in artist:
+        return artist.split(',')
+    else:
+        return [artist]
+
+def _artist_set(artist_names):
+    return frozenset(simple(part.strip().lower()) for name in artist_names for part in split_artist_name(name))
+
+def _tokens(text):
+    # words are hashed so the scorer can compare them as integers, vectorised if numpy is around
+    return frozenset(hash(word) for word in re.findall(r'\w+', text))
+
+# versions of a track that must never be matched against a track that isn't the same kind of version
+INSTRUMENTAL, ACAPELLA, REMIX = 1, 2, 4
+_FLAG_PATTERNS = (("instrumental", INSTRUMENTAL), ("acapella", ACAPELLA), ("remix", REMIX))
+
+def _flags(*texts):
+    return sum(flag for pattern, flag in _FLAG_PATTERNS if any(pattern in text for text in texts))
+
+class TrackKey:
+    ''' Everything match() compares, worked out once per track instead of on every comparison '''
+    __slots__ = ('title', 'normalized_title', 'simple_title', 'normalized_simple_title',
+                 'artists', 'normalized_artists', 'duration', 'isrc', 'flags',
+                 'title_tokens', 'full_title_tokens', 'artist_tokens')
+
+    def __init__(self, name, artist_names, duration, isrc, version=None):
+        self.title = name.lower()
+        self.normalized_title = normalize(self.title)
+        self.simple_title = simple(self.title).split('feat.')[0].strip()
+        self.normalized_simple_title = normalize(self.simple_title)
+        self.artists = _artist_set(artist_names)
+        self.normalized_artists = _artist_set(normalize(name) for name in artist_names)
+        self.duration = duration
+        self.isrc = isrc
+        self.flags = _flags(self.title, version.lower()) if version else _flags(self.title)
+        # the same, as sets of words for scoring
+        self.title_tokens = _tokens(self.normalized_title)
+        self.full_title_tokens = self.title_tokens | _tokens(normalize(version.lower())) if version else self.title_tokens
+        self.artist_tokens = frozenset(hash(artist) for artist in self.normalized_artists)
+
+def spotify_track_key(spotify_track):
+    ''' The TrackKey of a track dict from the Spotify API, built on first use and kept in the dict '''
+    key = spotify_track.get('_match_key')
+    if key is None:
+        key = spotify_track['_match_key'] = TrackKey(spotify_track['name'],
+                                                     [artist['name'] for artist in spotify_track['artists']],
+                                                     spotify_track['duration_ms']/1000,
+                                                     spotify_track['external_ids'].get('isrc'))
+    return key
+
+def tidal_track_key(tidal_track):
+    ''' The TrackKey of a tidalapi Track, built on first use and kept on the track '''
+    key = getattr(tidal_track, '_match_key', None)
+    if key is None:
+        key = tidal_track._match_key = TrackKey(tidal_track.name,
+                                                [artist.name for artist in tidal_track.artists],
+                                                tidal_track.duration,
+                                                tidal_track.isrc,
+                                                tidal_track.version)
+    return key